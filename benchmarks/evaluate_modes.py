@@ -0,0 +1,130 @@
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from pdf_processor import PDFProcessor
+
+# name -> PDFProcessor settings; all but "auto" ignore embedded bookmarks so the scan itself is measured
+MODES = {
+    "auto": {},
+    "full": {"scan_mode": "full", "use_embedded_toc": False},
+    "scheduled": {"scan_mode": "scheduled", "use_embedded_toc": False},
+    "streaming": {"scan_mode": "streaming", "use_embedded_toc": False},
+    "parallel": {"scan_mode": "parallel", "use_embedded_toc": False},
+}
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def heading_keys(outline, with_level):
+    # A heading counts as found when text and page agree; level accuracy additionally needs the level
+    return {(normalize(h["text"]), h["page"]) + ((h["level"],) if with_level else ()) for h in outline}
+
+
+def load_truth(pdf_dir, truth_dir):
+    pairs = []
+    for truth_path in sorted(Path(truth_dir).glob("*.json")):
+        pdf_path = Path(pdf_dir) / f"{truth_path.stem}.pdf"
+        if pdf_path.exists():
+            pairs.append((pdf_path, json.loads(truth_path.read_text(encoding='utf-8'))))
+    return pairs
+
+
+def evaluate(processor, pairs, time_limit):
+    counts = {"headings": [0, 0, 0], "levels": [0, 0, 0]}
+    title_hits = 0
+    seconds = 0.0
+    for pdf_path, truth in pairs:
+        start = time.perf_counter()
+        result = processor.extract_outline_fast(str(pdf_path), time.time(), time_limit)
+        seconds += time.perf_counter() - start
+
+        title_hits += normalize(result.get("title", "")) == normalize(truth.get("title", ""))
+        for key, with_level in (("headings", False), ("levels", True)):
+            found = heading_keys(result.get("outline", []), with_level)
+            expected = heading_keys(truth.get("outline", []), with_level)
+            counts[key][0] += len(found & expected)
+            counts[key][1] += len(found)
+            counts[key][2] += len(expected)
+
+    row = {"seconds": seconds, "title_accuracy": title_hits / len(pairs)}
+    for key, (hits, found, expected) in counts.items():
+        # Micro-averaged over all documents
+        precision = hits / found if found else 0.0
+        recall = hits / expected if expected else 1.0
+        row[key] = {"precision": precision, "recall": recall,
+                    "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0}
+    return row
+
+
+def mark_pareto(rows):
+    # A configuration is on the front if no other one is at least as fast and at least as accurate, and better in one
+    for row in rows:
+        row["pareto"] = not any(
+            other is not row
+            and other["seconds"] <= row["seconds"] and other["levels"]["f1"] >= row["levels"]["f1"]
+            and (other["seconds"] < row["seconds"] or other["levels"]["f1"] > row["levels"]["f1"])
+            for other in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare scan modes and time limits against ground-truth outlines")
+    parser.add_argument("truth_dir", help="directory of <name>.json files in the output schema")
+    parser.add_argument("--pdf-dir", default=str(ROOT / "input"), help="directory holding the matching <name>.pdf files")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--time-limits", nargs="+", type=float, default=[10.0])
+    parser.add_argument("--max-full-scan-pages", nargs="+", type=int, default=[30],
+                        help="values to try for the auto mode's full-scan threshold")
+    parser.add_argument("--page-workers", type=int, default=2, help="workers for the parallel mode")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    pairs = load_truth(args.pdf_dir, args.truth_dir)
+    if not pairs:
+        sys.exit(f"no ground-truth JSON in {args.truth_dir} with a matching PDF in {args.pdf_dir}")
+
+    logging.disable(logging.WARNING)
+    rows = []
+    for mode in args.modes:
+        for full_scan_pages in (args.max_full_scan_pages if mode == "auto" else [None]):
+            processor = PDFProcessor()
+            processor.page_workers = args.page_workers if mode == "parallel" else 1
+            for name, value in MODES[mode].items():
+                setattr(processor, name, value)
+            if full_scan_pages is not None:
+                processor.max_full_scan_pages = full_scan_pages
+            processor.warm_up()
+
+            for time_limit in args.time_limits:
+                row = evaluate(processor, pairs, time_limit)
+                label = mode if full_scan_pages is None else f"{mode} (full<={full_scan_pages})"
+                row.update({"mode": label, "time_limit": time_limit})
+                rows.append(row)
+            processor.close()
+
+    mark_pareto(rows)
+    rows.sort(key=lambda r: r["seconds"])
+    print(f"{len(pairs)} documents; precision/recall/F1 on (text, page), level adds the H1-H3 level")
+    print(f"{'mode':24} {'limit':>5} {'seconds':>8} {'head P':>6} {'head R':>6} {'head F1':>7} "
+          f"{'lvl P':>6} {'lvl R':>6} {'lvl F1':>6} {'title':>5}  pareto")
+    for row in rows:
+        h, lv = row["headings"], row["levels"]
+        print(f"{row['mode']:24} {row['time_limit']:5g} {row['seconds']:8.3f} {h['precision']:6.3f} {h['recall']:6.3f} "
+              f"{h['f1']:7.3f} {lv['precision']:6.3f} {lv['recall']:6.3f} {lv['f1']:6.3f} {row['title_accuracy']:5.2f}  "
+              f"{'*' if row['pareto'] else ''}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2) + "\n", encoding='utf-8')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import re
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import fitz
+from page_store import LineStore
+from heading_detector import HeadingDetector
+from utils import HEADING_KEYWORDS, is_likely_heading
+
+# The per-line implementations the compiled matcher replaced, kept here as the reference
+LEGACY_PATTERNS = [
+    r'^(chapter|section|appendix|part)\s+\d+',
+    r'^\d+(\.\d+)*\s+[a-zA-Z]',
+    r'^([ivxlcdm]+)\.?\s+[a-zA-Z]',
+    r'^[a-z]\.\s+[a-zA-Z]',
+    r'^(abstract|introduction|conclusion|references|bibliography)$'
+]
+
+
+def legacy_is_likely_heading(text):
+    if not text or len(text) < 3:
+        return False
+    text = text.strip()
+    text_lower = text.lower()
+    if len(text) > 150:
+        return False
+    if any(keyword in text_lower for keyword in HEADING_KEYWORDS):
+        return True
+    if any(re.match(pattern, text_lower) for pattern in LEGACY_PATTERNS):
+        return True
+    if text.isupper() and 5 <= len(text) <= 80:
+        return True
+    if re.match(r'^[A-Z][a-z]*(\s+[A-Z][a-z]*)*$', text) and len(text) <= 100:
+        return True
+    if re.match(r'^[A-Z][a-z]*.*[^.]$', text) and 10 <= len(text) <= 60:
+        if 2 <= len(text.split()) <= 8:
+            return True
+    return False
+
+
+def legacy_detector_features(detector, text):
+    text_lower = text.lower()
+    keyword_matches = sum(1 for keyword in detector.heading_keywords if keyword in text_lower)
+    pattern = next((i for i, p in enumerate(detector.heading_patterns) if p.match(text)), None)
+    false_positive = any(p.match(text_lower) for p in detector.heading_patterns)
+    return keyword_matches, pattern, false_positive
+
+
+def compiled_detector_features(detector, text):
+    match = detector.heading_matcher.match(text)
+    false_positive = detector.heading_matcher.pattern_index(text.lower()) is not None
+    return len(match.keywords), match.pattern, false_positive
+
+
+def load_lines(pdf_paths):
+    texts = []
+    for path in pdf_paths:
+        with fitz.open(path) as doc:
+            lines = LineStore()
+            # Body lines are normally kept without text; the benchmark wants every line, as it used to
+            lines.full_pages = set(range(len(doc)))
+            lines.ensure_pages(doc, range(len(doc)))
+            texts.extend(lines.texts)
+    return texts
+
+
+def per_line_us(func, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-line cost of heading text classification, before and after")
+    parser.add_argument("pdfs", nargs="*", default=sorted(str(p) for p in (ROOT / "input").glob("*.pdf")))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    texts = load_lines(args.pdfs)
+    if not texts:
+        sys.exit("no text lines found")
+    detector = HeadingDetector()
+
+    mismatches = sum(legacy_is_likely_heading(t) != is_likely_heading(t) for t in texts)
+    mismatches += sum(legacy_detector_features(detector, t) != compiled_detector_features(detector, t) for t in texts)
+
+    rows = [
+        ("utils.is_likely_heading", legacy_is_likely_heading, is_likely_heading),
+        ("detector keywords + patterns",
+         lambda t: legacy_detector_features(detector, t), lambda t: compiled_detector_features(detector, t)),
+    ]
+    print(f"{len(texts)} lines from {len(args.pdfs)} PDFs, best of {args.repeat}")
+    print(f"{'':32} {'before':>10} {'after':>10} {'speedup':>8}")
+    for name, before, after in rows:
+        before_us = per_line_us(before, texts, args.repeat)
+        after_us = per_line_us(after, texts, args.repeat)
+        print(f"{name:32} {before_us:8.2f}us {after_us:8.2f}us {before_us / after_us:7.2f}x")
+
+    if mismatches:
+        print(f"MISMATCH: {mismatches} lines classified differently")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
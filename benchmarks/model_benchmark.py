@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import fitz
+import numpy as np
+from page_store import LineStore
+from heading_detector import HeadingDetector
+from utils import semantic_model_available, SENTENCE_MODEL_PATH
+
+
+def load_texts(pdf_paths):
+    texts = []
+    for path in pdf_paths:
+        with fitz.open(path) as doc:
+            lines = LineStore()
+            lines.ensure_pages(doc, range(len(doc)))
+            texts.extend(t for t in lines.texts if t and len(t) > 5)
+    return list(dict.fromkeys(texts))
+
+
+def make_detector(quantize, threads):
+    detector = HeadingDetector(embedding_memo_size=0)
+    detector.quantize_model = quantize
+    detector.model_threads = threads
+    start = time.perf_counter()
+    detector.model
+    return detector, time.perf_counter() - start
+
+
+def score(detector, texts, batch_size, repeat):
+    best = float("inf")
+    scores = None
+    for _ in range(repeat):
+        # No memo, so every run pays for the full forward passes
+        detector._embedding_memo.clear()
+        start = time.perf_counter()
+        scores = np.concatenate([detector._calculate_model_scores(texts[i:i + batch_size])
+                                 for i in range(0, len(texts), batch_size)])
+        best = min(best, time.perf_counter() - start)
+    return scores, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of fp32 vs int8 heading embeddings and agreement of their scores")
+    parser.add_argument("pdfs", nargs="*", default=sorted(str(p) for p in (ROOT / "input").glob("*.pdf")))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-agreement", type=float, default=0.95,
+                        help="fail if int8 and fp32 disagree on more than this share of lines crossing 0.5")
+    args = parser.parse_args()
+
+    if not semantic_model_available():
+        sys.exit(f"needs sentence-transformers and a saved model in {SENTENCE_MODEL_PATH} (run download_models.py)")
+
+    logging.disable(logging.WARNING)
+    texts = load_texts(args.pdfs)
+    if not texts:
+        sys.exit("no text lines found")
+
+    print(f"{len(texts)} distinct lines from {len(args.pdfs)} PDFs, best of {args.repeat}")
+    print(f"{'variant':8} {'threads':>7} {'load s':>7} {'per line':>10} {'lines/s':>8}")
+    results = {}
+    for quantize in (False, True):
+        for threads in dict.fromkeys(args.threads):
+            detector, load_seconds = make_detector(quantize, threads)
+            scores, seconds = score(detector, texts, args.batch_size, args.repeat)
+            name = "int8" if quantize else "fp32"
+            results[name] = scores
+            print(f"{name:8} {threads:7} {load_seconds:7.2f} {seconds / len(texts) * 1e6:8.0f}us "
+                  f"{len(texts) / seconds:8.0f}")
+
+    fp32, int8 = results["fp32"], results["int8"]
+    # The detector takes max(keyword score, model score), so what matters is the size of the drift
+    # and whether lines land on the same side of the scores that usually decide a heading
+    diff = np.abs(fp32 - int8)
+    agreement = np.mean((fp32 >= 0.5) == (int8 >= 0.5))
+    correlation = np.corrcoef(fp32, int8)[0, 1] if len(texts) > 1 else 1.0
+    print(f"score drift: mean {diff.mean():.4f}, max {diff.max():.4f}; correlation {correlation:.4f}; "
+          f"agreement at 0.5: {agreement:.3%}")
+
+    if agreement < args.min_agreement:
+        print(f"AGREEMENT BELOW {args.min_agreement:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
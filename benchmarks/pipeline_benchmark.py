@@ -0,0 +1,194 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import fitz
+from pdf_processor import PDFProcessor
+
+BASELINE_PATH = Path(__file__).resolve().parent / "pipeline_baselines.json"
+WORDS = ("the of data system analysis model result method value process table figure "
+         "report section design review study approach evaluation performance").split()
+
+# name -> generator settings; "pages_50" backs the README's sub-10-second claim
+SCENARIOS = {
+    "pages_10": dict(pages=10),
+    "pages_50": dict(pages=50),
+    "pages_200": dict(pages=200),
+    "pages_600": dict(pages=600),
+    "dense_headings": dict(pages=50, heading_density=0.8),
+    "sparse_headings": dict(pages=50, heading_density=0.05),
+    "mixed_fonts": dict(pages=50, fonts=("helv", "tiro", "cour"), sizes=(9, 10, 11)),
+    "two_columns": dict(pages=50, columns=2),
+    # Numbered module titles at the top of every page must not be taken for a running header
+    "module_pages": dict(pages=8, module_titles=True),
+    # Bold running lines that carry the page number, or a page number offset by front matter,
+    # look like numbered headings and must still be pruned as running lines
+    "numbered_header": dict(pages=24, heading_density=0.05, header="{page} Annual Report 2024",
+                            running_font="hebo", running_size=10),
+    "offset_footer": dict(pages=24, heading_density=0.05, footer="{printed} Internal Use Only", footer_left=True,
+                          running_font="hebo", running_size=10),
+}
+HARD_LIMITS = {"pages_50": 10.0}
+# Counts a scenario must produce regardless of the baselines
+EXPECTED = {
+    "module_pages": {"h1": 8},
+    "numbered_header": {"running": 0},
+    "offset_footer": {"running": 0},
+}
+# Text of the generated running headers and footers; none of it may end up in the outline
+RUNNING_TEXTS = ("Synthetic Benchmark Document", "Annual Report 2024", "Internal Use Only")
+
+
+def make_pdf(path, pages, heading_density=0.3, fonts=("helv",), sizes=(10,), columns=1, module_titles=False,
+             header="Synthetic Benchmark Document", footer="Page {page}", running_font="helv", running_size=8, footer_left=False,
+             seed=0):
+    # Chapters on every third page (or a "Module N Overview" title on top of every page with module_titles),
+    # numbered subsections at heading_density per paragraph, a running header and footer, and body text in
+    # the given fonts, sizes and columns. header and footer are formatted with the page number ({page}) and
+    # the number printed after two pages of front matter ({printed}, left out on those pages).
+    rng = random.Random(seed)
+    doc = fitz.open()
+    width, height = fitz.paper_size("a4")
+    column_width = (width - 144 - 20 * (columns - 1)) / columns
+    for page_num in range(pages):
+        page = doc.new_page(width=width, height=height)
+        numbers = dict(page=page_num + 1, printed=page_num - 1)
+        for text, position in ((header, (72, 30)), (footer, (72 if footer_left else width / 2, height - 20))):
+            if "{printed}" not in text or numbers["printed"] > 0:
+                page.insert_text(position, text.format(**numbers), fontsize=running_size, fontname=running_font)
+
+        for column in range(columns):
+            x = 72 + column * (column_width + 20)
+            y = 60
+            if module_titles:
+                if column == 0:
+                    page.insert_text((x, 60), f"Module {page_num + 1} Overview", fontsize=20, fontname="hebo")
+                y = 80
+            elif column == 0 and page_num % 3 == 0:
+                page.insert_text((x, y + 20), f"{page_num // 3 + 1}. Chapter {page_num // 3 + 1} Overview",
+                                 fontsize=18, fontname="hebo")
+                y += 40
+            # Module pages are slide-like, with half the text
+            for paragraph in range(4 if module_titles else 8):
+                if rng.random() < heading_density:
+                    page.insert_text((x, y + 14), f"{page_num // 3 + 1}.{paragraph + 1} Section {paragraph} Results",
+                                     fontsize=13, fontname="hebo")
+                    y += 24
+                font = rng.choice(fonts)
+                size = rng.choice(sizes)
+                words_per_line = max(3, int(column_width / (size * 3.2)))
+                for _ in range(rng.randint(3, 6)):
+                    line = " ".join(rng.choice(WORDS) for _ in range(words_per_line)).capitalize() + "."
+                    page.insert_text((x, y + size), line, fontsize=size, fontname=font)
+                    y += size * 1.3
+                    if y > height - 80:
+                        break
+                y += 8
+                if y > height - 100:
+                    break
+    doc.save(str(path))
+    doc.close()
+
+
+def run_scenario(processor, pdf_path, page_count, time_limit, repeat):
+    best = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = processor.extract_outline_fast(str(pdf_path), time.time(), time_limit)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if best is None or elapsed < best["seconds"]:
+            best = {
+                "seconds": elapsed,
+                "pages_per_sec": page_count / elapsed,
+                "peak_mib": peak / 2 ** 20,
+                "headings": len(result["outline"]),
+                "h1": sum(1 for heading in result["outline"] if heading["level"] == "H1"),
+                "running": sum(1 for heading in result["outline"]
+                               if any(text in heading["text"] for text in RUNNING_TEXTS)),
+                "stages": dict(processor.stage_timings),
+            }
+    return best
+
+
+def check(name, sample, baseline, tolerance):
+    failures = []
+    if name in HARD_LIMITS and sample["seconds"] > HARD_LIMITS[name]:
+        failures.append(f"{name}: {sample['seconds']:.2f}s exceeds the hard limit of {HARD_LIMITS[name]}s")
+    for field, expected in EXPECTED.get(name, {}).items():
+        if sample[field] != expected:
+            failures.append(f"{name}: {sample[field]} {field} headings, expected {expected}")
+    if baseline is None:
+        return failures
+    if sample["seconds"] > baseline["seconds"] * (1 + tolerance):
+        failures.append(f"{name}: {sample['seconds']:.3f}s vs baseline {baseline['seconds']:.3f}s")
+    if sample["peak_mib"] > baseline["peak_mib"] * (1 + tolerance):
+        failures.append(f"{name}: peak {sample['peak_mib']:.1f} MiB vs baseline {baseline['peak_mib']:.1f} MiB")
+    if sample["headings"] != baseline["headings"]:
+        failures.append(f"{name}: {sample['headings']} headings vs baseline {baseline['headings']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run synthetic PDFs through the pipeline and compare against stored baselines")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help=f"any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the fastest is reported")
+    parser.add_argument("--time-limit", type=float, default=10)
+    parser.add_argument("--page-workers", type=int, default=1)
+    parser.add_argument("--check", action="store_true", help="exit non-zero on a regression against the baselines")
+    parser.add_argument("--update-baseline", action="store_true", help=f"write the results to {BASELINE_PATH.name}")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown or memory growth (0.5 = 50%%)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(unknown)}")
+
+    logging.disable(logging.WARNING)
+    processor = PDFProcessor()
+    processor.page_workers = args.page_workers
+    processor.warm_up()
+    baselines = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+
+    results = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'scenario':16} {'pages':>5} {'seconds':>8} {'pages/s':>8} {'peak MiB':>9} {'heads':>5}  stages (ms)")
+        for name in args.scenarios:
+            settings = SCENARIOS[name]
+            pdf_path = Path(tmp) / f"{name}.pdf"
+            make_pdf(pdf_path, **settings)
+
+            sample = run_scenario(processor, pdf_path, settings["pages"], args.time_limit, args.repeat)
+            results[name] = sample
+            stages = " ".join(f"{stage}={seconds * 1000:.0f}" for stage, seconds in sample["stages"].items())
+            print(f"{name:16} {settings['pages']:5} {sample['seconds']:8.3f} {sample['pages_per_sec']:8.1f} "
+                  f"{sample['peak_mib']:9.2f} {sample['headings']:5}  {stages}")
+            failures.extend(check(name, sample, baselines.get(name) if args.check else None, args.tolerance))
+    processor.close()
+
+    if args.update_baseline:
+        baselines.update(results)
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"Baselines written to {BASELINE_PATH}")
+
+    if failures:
+        print("REGRESSION:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+
+# Runs in a fresh interpreter so every sample is a true cold start
+PROBE = r"""
+import sys
+import json
+import time
+t0 = time.perf_counter()
+import pdf_processor
+t1 = time.perf_counter()
+processor = pdf_processor.PDFProcessor()
+t2 = time.perf_counter()
+processor.extract_outline_fast(sys.argv[1], time.time(), 10)
+t3 = time.perf_counter()
+heavy = [m for m in ("numpy", "torch", "sentence_transformers", "sklearn") if m in sys.modules]
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "init_ms": (t2 - t1) * 1000,
+    "first_result_ms": (t3 - t0) * 1000,
+    "heavy_modules": heavy,
+}))
+"""
+
+
+def run_probe(pdf_path):
+    env = dict(os.environ, PYTHONPATH=str(SRC))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", PROBE, str(pdf_path)], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+    sample = json.loads(proc.stdout.strip().splitlines()[-1])
+    sample["process_ms"] = (time.perf_counter() - start) * 1000
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time and time to first result")
+    parser.add_argument("pdf", nargs="?", default=str(ROOT / "input" / "file02.pdf"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, help="fail if the median import time exceeds this")
+    parser.add_argument("--max-first-result-ms", type=float, help="fail if the median time to first result exceeds this")
+    args = parser.parse_args()
+
+    samples = [run_probe(args.pdf) for _ in range(args.runs)]
+    medians = {key: statistics.median(s[key] for s in samples)
+               for key in ("import_ms", "init_ms", "first_result_ms", "process_ms")}
+
+    print(f"{Path(args.pdf).name}, {args.runs} cold starts (median)")
+    print(f"  import pdf_processor   {medians['import_ms']:8.1f} ms")
+    print(f"  PDFProcessor()         {medians['init_ms']:8.1f} ms")
+    print(f"  time to first result   {medians['first_result_ms']:8.1f} ms")
+    print(f"  whole process          {medians['process_ms']:8.1f} ms")
+    print(f"  heavy modules loaded   {', '.join(samples[-1]['heavy_modules']) or 'none'}")
+
+    failures = []
+    if args.max_import_ms is not None and medians["import_ms"] > args.max_import_ms:
+        failures.append(f"import time {medians['import_ms']:.1f} ms > {args.max_import_ms} ms")
+    if args.max_first_result_ms is not None and medians["first_result_ms"] > args.max_first_result_ms:
+        failures.append(f"time to first result {medians['first_result_ms']:.1f} ms > {args.max_first_result_ms} ms")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import os
+import sys
 import nltk
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from utils import SENTENCE_MODEL_PATH, PROTOTYPE_EMBEDDINGS_PATH, PROTOTYPE_TEXTS
+
 
 def download_models():
     os.makedirs('./models', exist_ok=True)
 
     model = SentenceTransformer('paraphrase-MiniLM-L3-v2')
-    model.save('./models/sentence_model')
+    model.save(SENTENCE_MODEL_PATH)
+
+    # Heading prototypes are fixed, so encode them once here instead of in every detector
+    embeddings = model.encode(PROTOTYPE_TEXTS, convert_to_numpy=True).astype(np.float32)
+    np.savez(PROTOTYPE_EMBEDDINGS_PATH, texts=np.array(PROTOTYPE_TEXTS), embeddings=embeddings)
 
     os.environ['NLTK_DATA'] = './models/nltk_data'
     nltk.download('punkt', download_dir='./models/nltk_data')
@@ -0,0 +1,64 @@
+import os
+import time
+import logging
+from typing import Collection, List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Fitted on get_text("dict") plus line extraction; the per-page cost when no page could be timed
+SECONDS_PER_PAGE = 1.5e-3
+# Detection, level assignment and writing the result, relative to parsing
+DETECTION_OVERHEAD = 0.25
+
+
+class CostEstimate(NamedTuple):
+    pages: int
+    seconds_per_page: float
+    # Predicted wall time of a full sequential scan including detection
+    seconds: float
+
+
+def _sample_pages(page_count: int, samples: int) -> List[int]:
+    if page_count <= samples:
+        return list(range(page_count))
+    return sorted({page_count * (2 * i + 1) // (2 * samples) for i in range(samples)})
+
+
+# Cheap per-document cost predictions: the size on disk before a file is opened, refined by
+# timing the parse of a few pages once it is
+class CostModel:
+    def __init__(self, samples: int = 3):
+        self.samples = samples
+
+    def probe_document(self, doc, lines) -> CostEstimate:
+        # Parses a few spread-out pages into the shared store and times them; the work is not wasted
+        page_count = len(doc)
+        timings = []
+        for page_num in _sample_pages(page_count, self.samples):
+            if lines.has_page(page_num):
+                continue
+            start = time.perf_counter()
+            lines.ensure_pages(doc, [page_num])
+            timings.append(time.perf_counter() - start)
+
+        if timings:
+            timings.sort()
+            per_page = timings[len(timings) // 2]
+        else:
+            per_page = SECONDS_PER_PAGE
+        return CostEstimate(page_count, per_page, page_count * per_page * (1 + DETECTION_OVERHEAD))
+
+    def order_longest_first(self, pdf_files, settled: Collection = ()):
+        # Longest-processing-time-first keeps the last worker from finishing long after the others.
+        # Ranking costs one stat per file, never opening it: most files are cache hits or done on a
+        # warm re-run. Settled files (e.g. done in the job ledger) are skipped in no time and go last.
+        sizes = {}
+        for pdf_path in pdf_files:
+            if pdf_path in settled:
+                continue
+            try:
+                sizes[pdf_path] = os.path.getsize(pdf_path)
+            except OSError:
+                sizes[pdf_path] = 0
+        ranked = sorted(sizes, key=lambda p: sizes[p], reverse=True)
+        return ranked + [pdf_path for pdf_path in pdf_files if pdf_path not in sizes]
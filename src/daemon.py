@@ -0,0 +1,124 @@
+import sys
+import queue
+import signal
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class OutlineDaemon:
+    def __init__(self, extractor, poll_interval=1.0):
+        self.extractor = extractor
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        # path -> (size, mtime) of files already handled or waiting to settle
+        self._processed = {}
+        self._pending = {}
+
+    def install_signal_handlers(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        logger.info(f"Received signal {signum}, finishing current file and shutting down")
+        self.stop()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def start(self):
+        self.extractor.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.extractor.processor is None:
+            from pdf_processor import PDFProcessor
+            self.extractor.processor = PDFProcessor()
+        # Pay imports and model loading once, before the first file arrives
+        self.extractor.processor.warm_up()
+
+    def watch(self):
+        self.start()
+        logger.info(f"Watching {self.extractor.input_dir} for new PDF files")
+
+        while not self.stopped:
+            for pdf_path in self._ready_files():
+                if self.stopped:
+                    break
+                self.extractor._process_single_pdf(pdf_path)
+            self._stop.wait(self.poll_interval)
+
+        logger.info("Watch mode stopped")
+
+    def read_stdin(self, stream=None):
+        self.start()
+        stream = stream or sys.stdin
+        logger.info("Reading PDF paths from stdin")
+
+        # readline() cannot be interrupted by the stop event, so a daemon thread reads and the
+        # loop below waits on the queue with a timeout; a signal while idle stops within one poll
+        lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(stream, lines), daemon=True).start()
+
+        while not self.stopped:
+            try:
+                line = lines.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            if line is None:
+                break
+            path = line.strip()
+            if not path:
+                continue
+            pdf_path = Path(path)
+            if not pdf_path.is_file():
+                logger.warning(f"Not a file: {path}")
+                continue
+            self.extractor._process_single_pdf(pdf_path)
+
+        logger.info("Stdin mode stopped")
+
+    @staticmethod
+    def _read_lines(stream, lines):
+        try:
+            for line in stream:
+                lines.put(line)
+        finally:
+            # End of input
+            lines.put(None)
+
+    def _ready_files(self):
+        ready = []
+        for pdf_path in sorted(self.extractor.input_dir.glob("*.pdf")):
+            try:
+                stat = pdf_path.stat()
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+
+            if self._processed.get(pdf_path) == signature:
+                continue
+            if pdf_path not in self._processed and self._is_up_to_date(pdf_path, stat.st_mtime):
+                self._processed[pdf_path] = signature
+                continue
+
+            # A file still being copied in changes between polls; wait until it settles
+            if self._pending.get(pdf_path) != signature:
+                self._pending[pdf_path] = signature
+                continue
+
+            del self._pending[pdf_path]
+            self._processed[pdf_path] = signature
+            ready.append(pdf_path)
+
+        return ready
+
+    def _is_up_to_date(self, pdf_path, pdf_mtime):
+        output_path = self.extractor.output_dir / f"{pdf_path.stem}.json"
+        try:
+            return output_path.stat().st_mtime >= pdf_mtime
+        except OSError:
+            return False
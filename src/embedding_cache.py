@@ -0,0 +1,91 @@
+import time
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable
+
+import numpy as np
+
+
+# Heading embeddings shared across runs and worker processes. Vectors are stored as float32
+# blobs in one SQLite file, memory-mapped for reads, and the least recently used entries are
+# evicted above max_entries. Entries are keyed by model variant, so fp32 and int8 never mix.
+# WAL needs shared memory between the processes, so the file must be on a local disk of one host.
+class EmbeddingCache:
+    def __init__(self, path, variant: str, max_entries: int = 100000, touch_batch: int = 1000):
+        self.path = Path(path)
+        self.variant = variant
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Read hits only refresh last_used, which eviction can see late; they are written with the
+        # next insert or once this many are pending, so reads never wait for the write lock
+        self.touch_batch = touch_batch
+        self._touched: Dict[str, float] = {}
+
+        # Each worker opens its own connection; WAL lets readers run while one process writes
+        self._conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                           "variant TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, "
+                           "last_used REAL NOT NULL, PRIMARY KEY (variant, text))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+
+    def close(self):
+        if self._touched:
+            with self._transaction():
+                self._flush_touched()
+        self._conn.close()
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        texts = list(dict.fromkeys(texts))
+        found = {}
+        # SQLite limits bound parameters per statement
+        for i in range(0, len(texts), 500):
+            chunk = texts[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT text, vector FROM embeddings WHERE variant = ? AND text IN ({','.join('?' * len(chunk))})",
+                [self.variant, *chunk]).fetchall()
+            found.update((text, np.frombuffer(vector, dtype=np.float32)) for text, vector in rows)
+
+        if found:
+            self._touched.update(dict.fromkeys(found, time.time()))
+            if len(self._touched) >= self.touch_batch:
+                with self._transaction():
+                    self._flush_touched()
+        return found
+
+    def put_many(self, embeddings: Dict[str, np.ndarray]):
+        if not embeddings:
+            return
+        now = time.time()
+        with self._transaction():
+            self._flush_touched()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (variant, text, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(self.variant, text, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                 for text, vector in embeddings.items()])
+
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                # Evict down to 90% so a full cache does not evict on every insert
+                excess = count - int(self.max_entries * 0.9)
+                self._conn.execute("DELETE FROM embeddings WHERE rowid IN "
+                                   "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+
+    def _flush_touched(self):
+        touched, self._touched = self._touched, {}
+        self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE variant = ? AND text = ?",
+                               [(last_used, self.variant, text) for text, last_used in touched.items()])
+
+    @contextmanager
+    def _transaction(self):
+        # Take the write lock up front, so concurrent writers queue instead of failing mid-way
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
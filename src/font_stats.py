@@ -0,0 +1,60 @@
+import math
+from collections import Counter
+from typing import Any, Dict, Iterable
+
+
+# Running font-size and indent statistics for a stream of pages. Sizes are kept as an
+# exact histogram (documents use a handful of distinct sizes), so percentiles match
+# np.percentile over all lines without holding the lines themselves.
+class RunningFontStats:
+    def __init__(self):
+        self.size_counts = Counter()
+        self.count = 0
+        self.size_sum = 0.0
+        self.size_sq_sum = 0.0
+        self.indent_sum = 0.0
+        self.min_indent = math.inf
+
+    def __len__(self):
+        return self.count
+
+    def update(self, sizes: Iterable[float], indents: Iterable[float]):
+        for size, indent in zip(sizes, indents):
+            self.size_counts[size] += 1
+            self.count += 1
+            self.size_sum += size
+            self.size_sq_sum += size * size
+            self.indent_sum += indent
+            if indent < self.min_indent:
+                self.min_indent = indent
+
+    def percentile(self, q: float) -> float:
+        # Linear interpolation between the two closest ranks, as np.percentile does
+        rank = q / 100 * (self.count - 1)
+        lower, upper = math.floor(rank), math.ceil(rank)
+        lower_value = upper_value = None
+        seen = 0
+        for size in sorted(self.size_counts):
+            seen += self.size_counts[size]
+            if lower_value is None and seen > lower:
+                lower_value = size
+            if seen > upper:
+                upper_value = size
+                break
+        return lower_value + (upper_value - lower_value) * (rank - lower)
+
+    def analysis(self) -> Dict[str, Any]:
+        # Same shape as HeadingDetector._analysze_font_characteristics
+        mean = self.size_sum / self.count
+        variance = max(self.size_sq_sum / self.count - mean * mean, 0.0)
+        return {
+            'unique_sizes': sorted(self.size_counts, reverse=True),
+            'percentiles': {
+                'p75': self.percentile(75),
+                'p90': self.percentile(90),
+                'mean': mean,
+                'std': math.sqrt(variance)
+            },
+            'mean_indent': self.indent_sum / self.count,
+            'min_indent': self.min_indent
+        }
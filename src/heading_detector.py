@@ -1,35 +1,36 @@
+import os
 import re
+import heapq
 import logging
-import os
 import numpy as np
 
-from collections import Counter
-
-from typing import List , Dict , Any , Tuple
+from typing import List , Dict , Any , Tuple , Iterable
 
-try:
-    from sentence_transformers import SentenceTransformer
-    from sklearn.metrics.pairwise import cosine_similarity
-    MODEL_AVAILABLE = True
-except ImportError:
-    MODEL_AVAILABLE = False
-from utils import clean_text , is_likely_heading
+from utils import (clean_text , is_likely_heading , semantic_model_available , semantic_model_threads ,
+                   semantic_model_quantized , embedding_cache_settings , SENTENCE_MODEL_PATH ,
+                   PROTOTYPE_EMBEDDINGS_PATH , PROTOTYPE_TEXTS)
+from page_store import LineStore, RunningLineIndex
+from font_stats import RunningFontStats
+from text_matcher import TextMatcher
 
 logger = logging.getLogger(__name__)
 class HeadingDetector:
-    def __init__(self):
-        self.model = None
+    def __init__(self, embedding_memo_size: int = 20000):
+        # The model is loaded on first semantic use, not at construction
+        self._model = None
+        self._model_load_attempted = False
+        self.semantic_enabled = semantic_model_available()
+        self.model_threads = semantic_model_threads()
+        self.quantize_model = semantic_model_quantized()
+        self._torch = None
+        # Optional on-disk cache shared by all processes, opened with the model
+        self.embedding_cache = None
         self.prototype_embedding = None
-
-        if MODEL_AVAILABLE:
-            try:
-                model_path = './models/sentence_model'
-                if os.path.exists(model_path):
-                    self.mode=  SentenceTransformer(model_path)
-                    self.prototype_embedding = self._create_enhanced_prototypes()
-                    logger.info("Loaded enhanced heading detection model")
-            except Exception as e:
-                logger.warning(f"Could not load model: {e}")
+        # Normalized embeddings of strings already seen in this process
+        self._embedding_memo: Dict[str, np.ndarray] = {}
+        self.embedding_memo_size = embedding_memo_size
+        # Line and candidate counts of the last detection run
+        self.last_counts: Dict[str, int] = {}
         self.heading_patterns = [
             re.compile(r'^(Chapter|Section|Appendix|Part)\s+\d+', re.IGNORECASE),
             re.compile(r'^\d+(\.\d+)*\s+[A-Z]'),
@@ -58,38 +59,221 @@ class HeadingDetector:
             re.compile(r'^[^\w\s]*$'),
             re.compile(r'^(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)', re.IGNORECASE)
         ]
+        # Keyword hits and the first matching heading pattern in one precompiled pass
+        self.heading_matcher = TextMatcher(self.heading_keywords, self.heading_patterns)
+    @property
+    def model(self):
+        if self._model is None and not self._model_load_attempted:
+            self._load_model()
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
+        self._model_load_attempted = True
+
+    def _load_model(self):
+        self._model_load_attempted = True
+        if not self.semantic_enabled:
+            return
+        try:
+            # sentence_transformers pulls in torch, so it is only imported when actually needed
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            torch.set_num_threads(self.model_threads)
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                # Only allowed before the first parallel op in the process
+                pass
+            self._torch = torch
+
+            model = SentenceTransformer(SENTENCE_MODEL_PATH, device="cpu")
+            model.eval()
+            if self.quantize_model:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            self._model = model
+            self.prototype_embedding = self._load_prototypes()
+            self._open_embedding_cache()
+            logger.info(f"Loaded enhanced heading detection model "
+                        f"({'int8' if self.quantize_model else 'fp32'}, {self.model_threads} threads)")
+        except Exception as e:
+            logger.warning(f"Could not load model: {e}")
+
+    def _model_variant(self) -> str:
+        try:
+            version = int(os.path.getmtime(SENTENCE_MODEL_PATH))
+        except OSError:
+            version = 0
+        return f"{os.path.basename(SENTENCE_MODEL_PATH)}:{version}:{'int8' if self.quantize_model else 'fp32'}"
+
+    def _open_embedding_cache(self):
+        cache_path, max_entries = embedding_cache_settings()
+        if not cache_path:
+            return
+        try:
+            from embedding_cache import EmbeddingCache
+            self.embedding_cache = EmbeddingCache(cache_path, self._model_variant(), max_entries)
+        except Exception as e:
+            logger.warning(f"Embedding cache unavailable: {e}")
+
+    def _load_prototypes(self) -> np.ndarray:
+        # Precomputed by download_models.py for the fp32 model; int8 scores compare against int8 prototypes
+        if not self.quantize_model and os.path.exists(PROTOTYPE_EMBEDDINGS_PATH):
+            try:
+                with np.load(PROTOTYPE_EMBEDDINGS_PATH) as saved:
+                    if saved["texts"].tolist() == PROTOTYPE_TEXTS:
+                        return self._normalize(saved["embeddings"])
+                logger.warning("Saved prototype embeddings are out of date, re-encoding")
+            except Exception as e:
+                logger.warning(f"Could not read prototype embeddings: {e}")
+        return self._create_enhanced_prototypes()
+
     def _create_enhanced_prototypes(self) -> np.ndarray:
         if not self.model:
             return np.array([])
-        prototype_texts = [
-            "Introduction", "Abstract", "Summary", "Conclusion", "Discussion",
-            "Methodology", "Methods", "Results", "Analysis", "Evaluation",
-            "Background", "Literature Review", "Implementation", "Experiments",
-            "Chapter 1 Overview", "Section 2.1 Methods", "Appendix A Results",
-            "Theoretical Framework", "System Design", "Future Work"
-        ]
         try:
-            return self.mode.encode(prototype_texts)
+            return self._normalize(self._encode(PROTOTYPE_TEXTS))
         except Exception:
             return np.array([])
-    def detect_headings(self , text_elements: List[Dict[str ,Any]])-> List[Dict[str ,Any]]:
-        if not text_elements:
+
+    def _encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        # inference_mode also skips the version counters that no_grad still maintains
+        if self._torch is None:
+            return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        with self._torch.inference_mode():
+            return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        memo = self._embedding_memo
+        found = {t: memo[t] for t in texts if t in memo}
+        missing = list(dict.fromkeys(t for t in texts if t not in found))
+        if missing and self.embedding_cache is not None:
+            try:
+                cached = self.embedding_cache.get_many(missing)
+            except Exception as e:
+                logger.warning(f"Embedding cache read failed, disabling it: {e}")
+                self.embedding_cache = None
+                cached = {}
+            found.update(cached)
+            self._remember(cached)
+            missing = [t for t in missing if t not in cached]
+        if missing:
+            # One batched forward pass for everything not seen before
+            encoded = dict(zip(missing, self._normalize(self._encode(missing))))
+            found.update(encoded)
+            self._remember(encoded)
+            if self.embedding_cache is not None:
+                try:
+                    self.embedding_cache.put_many(encoded)
+                except Exception as e:
+                    logger.warning(f"Embedding cache write failed, disabling it: {e}")
+                    self.embedding_cache = None
+        return np.stack([found[t] for t in texts])
+
+    def _remember(self, embeddings: Dict[str, np.ndarray]):
+        memo = self._embedding_memo
+        if len(memo) + len(embeddings) > self.embedding_memo_size:
+            memo.clear()
+        memo.update(embeddings)
+
+    def _calculate_model_scores(self, texts: List[str]) -> np.ndarray:
+        scores = np.zeros(len(texts), dtype=np.float32)
+        if not self.model or self.prototype_embedding is None or self.prototype_embedding.size == 0:
+            return scores
+
+        indices = [i for i, text in enumerate(texts) if len(text) > 5]
+        if not indices:
+            return scores
+
+        try:
+            embeddings = self._embed_texts([texts[i] for i in indices])
+            # Rows are unit length, so the matrix product is the cosine similarity
+            similarities = embeddings @ self.prototype_embedding.T
+            scores[indices] = similarities.max(axis=1)
+        except Exception as e:
+            logger.warning(f"Semantic scoring failed: {e}")
+        return scores
+    def detect_headings(self , lines: LineStore , indices: np.ndarray = None ,
+                        font_analysis: Dict[str, Any] = None)-> List[Dict[str ,Any]]:
+        if indices is None:
+            indices = lines.heading_lines()
+        self.last_counts = {"lines": len(indices), "candidates": 0}
+        if len(indices) == 0:
             return []
-        font_analysis = self._analysze_font_characteristics(text_elements)
-        candidates = self._extract_heading_candidates(text_elements , font_analysis)
-        scored_candidates = self._score_candidates_advanced(candidates , font_analysis)
-        validated_heading = self._validate_and_filter(scored_candidates)
+        if font_analysis is None:
+            font_analysis = self._analysze_font_characteristics(lines , indices)
+        candidates = self._extract_heading_candidates(lines , indices , font_analysis)
+        self.last_counts["candidates"] = len(candidates)
+        ranked, scores = self._score_candidates_advanced(lines , candidates , font_analysis)
+        validated_heading = self._validate_and_filter(lines , ranked , scores)
         return self._cleanup(validated_heading)
-    def _analysze_font_characteristics(self, text_elements: List[Dict[str,Any]]) ->Dict[str,Any]:
-        font_sizes = [elem["font_size"] for elem in text_elements]
-        indentations = [elem.get("bbox" , [0,0,0,0])[0] for elem in text_elements]
+    def detect_headings_streaming(self, page_stores: Iterable[LineStore], max_candidates: int = 5000) -> List[Dict[str, Any]]:
+        # Pages are consumed one store at a time: every line feeds the running font statistics,
+        # but only lines that could become candidates are kept, at most max_candidates of them
+        stats = RunningFontStats()
+        # Stores may come from other processes, so running headers are tracked across all of them here
+        running_index = RunningLineIndex()
+        kept = []
+        seq = 0
+        for store in page_stores:
+            for keys in (store.running_key, store.page_key):
+                keyed = keys >= 0
+                for key, page_num in zip(keys[keyed].tolist(), store.page[keyed].tolist()):
+                    running_index.see(key, page_num)
+            indices = store.heading_lines()
+            if len(indices) == 0:
+                continue
+            stats.update(store.size[indices].tolist(), store.x0[indices].tolist())
+
+            lengths = store.length[indices]
+            eligible = indices[(lengths >= 3) & (lengths <= 150) & store.materialized[indices]
+                               & ~running_index.flagged_either(store.running_key[indices], store.page_key[indices])]
+            for i in eligible.tolist():
+                row = store.row(i)
+                if self._is_obvious_false_positive(row[0]):
+                    continue
+                # Smallest, non-bold lines are dropped first once the bound is reached
+                entry = (row[3], row[4], seq, i, row)
+                seq += 1
+                if len(kept) < max_candidates:
+                    heapq.heappush(kept, entry)
+                else:
+                    heapq.heappushpop(kept, entry)
+
+        if not kept:
+            self.last_counts = {"lines": len(stats), "candidates": 0}
+            return []
+        if len(kept) >= max_candidates:
+            logger.warning(f"Streaming detection kept the {max_candidates} most prominent candidate lines")
+
+        # Back to reading order, whatever order the pages arrived in; occurrences kept before
+        # a line was known to repeat are dropped by the candidate filter
+        candidates = LineStore(running_index)
+        for entry in sorted(kept, key=lambda e: (e[4][1], e[3])):
+            candidates.append_row(entry[4])
+        headings = self.detect_headings(candidates, np.arange(len(candidates)), stats.analysis())
+        self.last_counts["lines"] = len(stats)
+        return headings
+
+    def _analysze_font_characteristics(self, lines: LineStore, indices: np.ndarray) ->Dict[str,Any]:
+        font_sizes = lines.size[indices]
+        indentations = lines.x0[indices]
+        p75, p90 = np.percentile(font_sizes, [75, 90])
         font_stats = {
             'sizes': font_sizes,
-            'unique_sizes': sorted(list(set(font_sizes)), reverse=True),
-            'size_counts': Counter(font_sizes),
+            'unique_sizes': np.unique(font_sizes)[::-1].tolist(),
             'percentiles': {
-                'p75': np.percentile(font_sizes, 75),
-                'p90': np.percentile(font_sizes, 90),
+                'p75': p75,
+                'p90': p90,
                 'mean': np.mean(font_sizes),
                 'std': np.std(font_sizes)
             },
@@ -99,170 +283,109 @@ class HeadingDetector:
         }
         return font_stats
 
-    def _extract_heading_candidates(self, elements: List[Dict[str, Any]], font_analysis: Dict[str, Any]) -> List[
-        Dict[str, Any]]:
+    def _extract_heading_candidates(self, lines: LineStore, indices: np.ndarray, font_analysis: Dict[str, Any]) -> np.ndarray:
+        sizes = lines.size[indices]
+        lengths = lines.length[indices]
+        percentiles = font_analysis['percentiles']
+
+        # Font and layout points for every line at once: size 2, top-3 size 1, bold 2, indent 1
+        base_score = (2 * ((sizes >= percentiles['p75']) | (sizes > percentiles['mean'] * 1.2))
+                      + np.isin(sizes, font_analysis['unique_sizes'][:3])
+                      + 2 * lines.bold[indices]
+                      + (lines.x0[indices] <= font_analysis['mean_indent']))
+        # Body lines were never materialized as text, and running headers and footers are never
+        # headings; both only feed the statistics above
+        eligible = (lengths >= 3) & (lengths <= 150) & lines.materialized[indices] & ~lines.repeated[indices]
+
+        # Text features are only evaluated where they can still change the outcome:
+        # a pattern adds 3 points, likely-heading content adds 2, and 3 points are needed
+        texts = lines.texts
         candidates = []
-        size_threshold = font_analysis['percentiles']['p75']
-
-        for elem in elements:
-            text = elem["text"]
-            font_size = elem["font_size"]
-            is_bold = elem["is_bold"]
-            bbox = elem.get("bbox", [0, 0, 0, 0])
-            indent = bbox[0]
-
-            if self._is_potential_heading(text, font_size, is_bold, indent, size_threshold, font_analysis):
-                candidates.append(elem)
-
-        return candidates
-
-    def _is_potential_heading(self, text: str, font_size: float, is_bold: bool,
-                              indent: float, size_threshold: float, font_analysis: Dict[str, Any]) -> bool:
-        if len(text) < 3 or len(text) > 150:
-            return False
-
-        if self._is_obvious_false_positive(text):
-            return False
-
-        mean_font = font_analysis['percentiles']['mean']
-        unique_sizes = font_analysis['unique_sizes']
-
-        font_score = 0
-        if font_size >= size_threshold or font_size > mean_font * 1.2:
-            font_score += 2
-        if font_size in unique_sizes[:3]:
-            font_score += 1
-        if is_bold:
-            font_score += 2
-
-        pattern_score = 0
-        if any(pattern.match(text.strip()) for pattern in self.heading_patterns):
-            pattern_score = 3
-
-        content_score = 0
-        if is_likely_heading(text):
-            content_score = 2
-
-        layout_score = 0
-        if indent <= font_analysis['mean_indent']:
-            layout_score = 1
-
-        total_score = font_score + pattern_score + content_score + layout_score
-        return total_score >= 3
-    def _score_candidates_advanced(self, candidates : List[Dict[str,Any]] , font_analysis: Dict[str, Any]) -> List[Dict[str,Any]]:
-        scored_candidates = []
-
-        for candidate in candidates:
-            score = self._calculate_comprehensive_score(candidate, font_analysis)
-            candidate['heading_score'] = score
-            scored_candidates.append(candidate)
-
-        scored_candidates.sort(key=lambda x: x['heading_score'], reverse=True)
-        return scored_candidates
-
-    def _calculate_comprehensive_score(self, candidate: Dict[str, Any],
-                                       font_analysis: Dict[str, Any]) -> float:
-        text = candidate["text"]
-        font_size = candidate["font_size"]
-        is_bold = candidate["is_bold"]
-        bbox = candidate.get("bbox", [0, 0, 0, 0])
-
-        score = 0.0
-
-        font_score = self._calculate_font_score(font_size, is_bold, font_analysis)
-        pattern_score = self._calculate_pattern_score(text)
-        semantic_score = self._calculate_semantic_score(text)
-        layout_score = self._calculate_layout_score(bbox, font_analysis)
-        length_score = self._calculate_length_score(text)
-
-        score = (font_score * 0.25 + pattern_score * 0.25 +
-                 semantic_score * 0.25 + layout_score * 0.15 + length_score * 0.1)
-
-        return score
-    def _calculate_font_score(self , font_size:float , is_bold : bool , font_analysis: Dict[str, Any]) -> float:
+        for i, score in zip(indices[eligible].tolist(), base_score[eligible].tolist()):
+            text = texts[i]
+            if self._is_obvious_false_positive(text):
+                continue
+            if (score >= 3
+                    or self.heading_matcher.pattern_index(text) is not None
+                    or (score >= 1 and is_likely_heading(text))):
+                candidates.append(i)
+
+        return np.array(candidates, dtype=np.intp)
+
+    def _score_candidates_advanced(self, lines: LineStore, candidates: np.ndarray,
+                                   font_analysis: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        if len(candidates) == 0:
+            return candidates, np.array([])
+
+        texts = [lines.texts[i] for i in candidates.tolist()]
+        model_scores = self._calculate_model_scores(texts).tolist()
+
+        font_scores = self._calculate_font_scores(lines.size[candidates], lines.bold[candidates], font_analysis)
+        matches = [self.heading_matcher.match(text) for text in texts]
+        pattern_scores = np.array([self._calculate_pattern_score(text, match.pattern)
+                                   for text, match in zip(texts, matches)])
+        semantic_scores = np.array([self._calculate_semantic_score(len(match.keywords), model_score)
+                                    for match, model_score in zip(matches, model_scores)])
+        layout_scores = self._calculate_layout_scores(lines.x0[candidates], font_analysis)
+        length_scores = self._calculate_length_scores(lines.length[candidates])
+
+        scores = (font_scores * 0.25 + pattern_scores * 0.25 +
+                  semantic_scores * 0.25 + layout_scores * 0.15 + length_scores * 0.1)
+
+        # Stable, so equal scores keep document order
+        order = np.argsort(-scores, kind='stable')
+        return candidates[order], scores[order]
+
+    def _calculate_font_scores(self, sizes: np.ndarray, bold: np.ndarray, font_analysis: Dict[str, Any]) -> np.ndarray:
         unique_sizes = font_analysis['unique_sizes']
         mean_font = font_analysis['percentiles']['mean']
-        score = 0.0
         if len(unique_sizes) >= 3:
-            if font_size == unique_sizes[0]:
-                score += 1.0
-            elif font_size == unique_sizes[1]:
-                score += 0.8
-            elif font_size == unique_sizes[2]:
-                score += 0.6
+            scores = np.select([sizes == unique_sizes[0], sizes == unique_sizes[1], sizes == unique_sizes[2]],
+                               [1.0, 0.8, 0.6], 0.0)
         else:
-            if font_size > mean_font * 1.3:
-                score += 1.0
-            elif font_size > mean_font * 1.1:
-                score += 0.7
-
-        if is_bold:
-            score += 0.5
+            scores = np.select([sizes > mean_font * 1.3, sizes > mean_font * 1.1], [1.0, 0.7], 0.0)
 
-        return min(score, 1.0)
-    def _calculate_pattern_score(self , text:str)-> float:
+        return np.minimum(scores + 0.5 * bold, 1.0)
+    def _calculate_pattern_score(self , text:str , pattern_index: int = None)-> float:
         text_stripped = text.strip()
-        for i, pattern in enumerate(self.heading_patterns):
-            if pattern.match(text_stripped):
-                return 1.0 - (i * 0.1)
+        if pattern_index is not None:
+            return 1.0 - (pattern_index * 0.1)
 
         if text_stripped.isupper() and 5 <= len(text_stripped) <= 50:
             return 0.7
 
         return 0.0
 
-    def _calculate_semantic_score(self, text: str) -> float:
-        text_lower = text.lower()
-
-        keyword_matches = sum(1 for keyword in self.heading_keywords if keyword in text_lower)
+    def _calculate_semantic_score(self, keyword_matches: int, model_score: float = 0.0) -> float:
         keyword_score = min(keyword_matches / 3.0, 1.0)
 
-        model_score = 0.0
-        if self.model and self.prototype_embedding.size > 0 and len(text) > 5:
-            try:
-                text_embedding = self.model.encode([text])
-                similarities = cosine_similarity(text_embedding, self.prototype_embedding)
-                model_score = np.max(similarities)
-            except Exception:
-                pass
-
         return max(keyword_score, model_score)
 
-    def _calculate_layout_score(self, bbox: List[float], font_analysis: Dict[str, Any]) -> float:
-        indent = bbox[0]
+    def _calculate_layout_scores(self, indents: np.ndarray, font_analysis: Dict[str, Any]) -> np.ndarray:
         min_indent = font_analysis['min_indent']
         mean_indent = font_analysis['mean_indent']
-        if indent <= min_indent + 5:
-            return 1.0
-        elif indent <= mean_indent:
-            return 0.7
-        else:
-            return 0.3
+        return np.select([indents <= min_indent + 5, indents <= mean_indent], [1.0, 0.7], 0.3)
 
-    def _calculate_length_score(self, text: str) -> float:
-        length = len(text)
-        if 5 <= length <= 80:
-            return 1.0
-        elif 3 <= length <= 120:
-            return 0.7
-        else:
-            return 0.0
-    def _validate_and_filter (self , scored_candidates : List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        if not scored_candidates:
+    def _calculate_length_scores(self, lengths: np.ndarray) -> np.ndarray:
+        return np.select([(lengths >= 5) & (lengths <= 80), (lengths >= 3) & (lengths <= 120)], [1.0, 0.7], 0.0)
+    def _validate_and_filter (self , lines: LineStore , ranked: np.ndarray , scores: np.ndarray) -> List[Dict[str, Any]]:
+        if len(ranked) == 0:
             return []
-        threshold = max(0.4, scored_candidates[0]['heading_score'] * 0.6)
+        threshold = max(0.4, scores[0] * 0.6)
 
         validated = []
-        for candidate in scored_candidates:
-            if candidate['heading_score'] >= threshold:
-                validated.append(candidate)
+        for i, score in zip(ranked[scores >= threshold][:50].tolist(), scores[scores >= threshold][:50].tolist()):
+            # Only headings that survive filtering are materialized as dicts
+            heading = lines.line(i)
+            heading['heading_score'] = score
+            validated.append(heading)
 
-        return validated[:50]
+        return validated
     def _cleanup(self , headings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         cleaned = []
         seen_texts = set()
 
-        for heading in sorted(headings, key=lambda x: (x["page"], x.get("bbox", [0, 0, 0, 0])[1])):
+        for heading in sorted(headings, key=lambda x: (x["page"], x["y0"])):
             text = clean_text(heading["text"])
             text_lower = text.lower()
 
@@ -278,6 +401,6 @@ class HeadingDetector:
         text_clean = text.lower().strip()
         if len(text_clean) < 3:
             return True
-        return any(pattern.match(text_clean) for pattern in self.heading_patterns)
+        return self.heading_matcher.pattern_index(text_clean) is not None
 
 
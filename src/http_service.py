@@ -0,0 +1,219 @@
+import json
+import time
+import signal
+import asyncio
+import logging
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from pdf_processor import PDFProcessor
+from utils import validate_output
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 411: "Length Required", 413: "Payload Too Large",
+    415: "Unsupported Media Type", 429: "Too Many Requests", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+# Per-process processor used by executor workers, built once in _init_service_worker
+_service_processor = None
+
+
+def _init_service_worker():
+    global _service_processor
+    _service_processor = PDFProcessor()
+    # Requests already run in parallel across workers, so no nested page pools
+    _service_processor.page_workers = 1
+    _service_processor.warm_up()
+
+
+def _extract_in_worker(source, start_time, time_limit):
+    result = _service_processor.extract_outline_fast(source, start_time, time_limit)
+    if not validate_output(result):
+        result = {"title": "", "outline": []}
+    return result
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class OutlineService:
+    def __init__(self, host="127.0.0.1", port=8080, workers=1, max_pending=None,
+                 default_time_limit=10, max_time_limit=60, max_body_bytes=100 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.workers = max(1, int(workers))
+        # Requests running or waiting for a worker; beyond this clients get 429
+        self.max_pending = max_pending or self.workers * 4
+        self.default_time_limit = default_time_limit
+        self.max_time_limit = max_time_limit
+        self.max_body_bytes = max_body_bytes
+        self.header_timeout = 10
+        # A client that stalls mid-upload would otherwise hold its queue slot forever
+        self.body_timeout = 60
+        self._pending = 0
+        self._executor = None
+        # Connection handlers still running, awaited on shutdown
+        self._handlers = set()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_service_worker)
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Serving on http://{self.host}:{self.port} with {self.workers} workers, "
+                    f"queue limit {self.max_pending}")
+
+        try:
+            await stop.wait()
+        finally:
+            logger.info("Shutting down, waiting for running requests")
+            # Stop accepting, let the running handlers answer, then stop the workers. Shutting the
+            # executor down on the loop itself would block the handlers it is waiting for.
+            server.close()
+            if self._handlers:
+                await asyncio.wait(list(self._handlers))
+            await server.wait_closed()
+            await loop.run_in_executor(None, self._executor.shutdown)
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            await self._respond(reader, writer)
+        finally:
+            self._handlers.discard(task)
+
+    async def _respond(self, reader, writer):
+        try:
+            status, payload = await self._handle_request(reader)
+        except HTTPError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception as e:
+            logger.error(f"Error handling request: {e}")
+            status, payload = 500, {"error": "internal error"}
+
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            "Content-Type: application/json; charset=utf-8",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        if status == 429:
+            headers.append("Retry-After: 1")
+
+        try:
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('ascii') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        method, target, headers = await self._read_head(reader)
+        url = urlsplit(target)
+
+        if url.path == "/health":
+            return 200, {"status": "ok", "pending": self._pending, "max_pending": self.max_pending}
+        if url.path != "/outline":
+            raise HTTPError(404, "unknown endpoint")
+        if method != "POST":
+            raise HTTPError(405, "use POST")
+
+        # Refuse before reading the body, so a saturated server does not buffer uploads
+        if self._pending >= self.max_pending:
+            raise HTTPError(429, "server busy")
+
+        self._pending += 1
+        try:
+            start_time = time.time()
+            time_limit = self._time_limit(parse_qs(url.query), headers)
+            source = await self._read_source(reader, headers)
+
+            loop = asyncio.get_running_loop()
+            # The budget starts at arrival, so time spent queued counts against time_limit
+            return 200, await loop.run_in_executor(self._executor, _extract_in_worker, source, start_time, time_limit)
+        finally:
+            self._pending -= 1
+
+    async def _read_head(self, reader):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.header_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(408, "timed out reading request")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "request head too large")
+        except asyncio.IncompleteReadError:
+            raise HTTPError(400, "incomplete request")
+
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, headers
+
+    def _time_limit(self, query, headers):
+        value = query.get("time_limit", [headers.get("x-time-limit")])[0]
+        if value is None:
+            return self.default_time_limit
+        try:
+            time_limit = float(value)
+        except ValueError:
+            raise HTTPError(400, "time_limit must be a number")
+        if time_limit <= 0:
+            raise HTTPError(400, "time_limit must be positive")
+        return min(time_limit, self.max_time_limit)
+
+    async def _read_source(self, reader, headers):
+        if "content-length" not in headers:
+            raise HTTPError(411, "Content-Length required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HTTPError(400, "invalid Content-Length")
+        if length <= 0:
+            raise HTTPError(400, "empty body")
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "body too large")
+
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), self.body_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(408, "timed out reading request body")
+        except asyncio.IncompleteReadError:
+            raise HTTPError(400, "incomplete body")
+
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type == "application/json":
+            try:
+                path = json.loads(body).get("path")
+            except (ValueError, AttributeError):
+                raise HTTPError(400, "expected a JSON object with a \"path\"")
+            if not isinstance(path, str) or not Path(path).is_file():
+                raise HTTPError(400, "path does not point to a readable file")
+            return path
+        if content_type in ("application/pdf", "application/octet-stream", ""):
+            return body
+        raise HTTPError(415, "send application/pdf bytes or application/json with a path")
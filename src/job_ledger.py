@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Work ledger on a shared volume so several containers can split one input directory.
+# A PDF is claimed by creating its lease file with O_EXCL, which is atomic on NFS as well;
+# a done marker records completion. Leases of crashed nodes expire and are reclaimed by
+# renaming them away (only one reclaimer's rename succeeds) before claiming afresh.
+# SQLite is avoided on purpose: its locking is unreliable over NFS.
+class JobLedger:
+    def __init__(self, ledger_dir, node_id: Optional[str] = None, lease_seconds: float = 120):
+        self.ledger_dir = Path(ledger_dir)
+        self.node_id = node_id or socket.gethostname()
+        self.lease_seconds = lease_seconds
+        self.lease_dir = self.ledger_dir / "leases"
+        self.done_dir = self.ledger_dir / "done"
+        self.node_dir = self.ledger_dir / "nodes"
+        for directory in (self.lease_dir, self.done_dir, self.node_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        # Throughput of this process; each process writes only its own stats file
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.first_claim = None
+        self.last_complete = None
+        # Content of the leases this process created, by file name, to tell whether it still holds them
+        self._held: Dict[str, str] = {}
+
+    def job_key(self, pdf) -> str:
+        # pdf is a path or a PdfSource. A replaced input (new size or mtime) is a new job;
+        # archive members have no stat of their own and are keyed by their content
+        if getattr(pdf, "data", None) is not None:
+            content = hashlib.sha1(pdf.data).hexdigest()
+            digest = hashlib.sha1(f"{pdf.name}\0{content}".encode('utf-8')).hexdigest()
+            return f"{pdf.output_key.replace('/', '__')}.{digest[:16]}"
+        pdf_path = Path(getattr(pdf, "path", None) or pdf)
+        stat = pdf_path.stat()
+        digest = hashlib.sha1(f"{pdf_path.name}\0{stat.st_size}\0{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+        return f"{pdf_path.stem}.{digest[:16]}"
+
+    def is_done(self, pdf_path) -> bool:
+        return (self.done_dir / f"{self.job_key(pdf_path)}.json").exists()
+
+    def claim(self, pdf_path) -> bool:
+        key = self.job_key(pdf_path)
+        if (self.done_dir / f"{key}.json").exists():
+            return False
+
+        lease_path = self.lease_dir / f"{key}.lease"
+        for _ in range(2):
+            if self._create_lease(lease_path):
+                # Another node may have finished between the done check and the lease
+                if (self.done_dir / f"{key}.json").exists():
+                    self._held.pop(lease_path.name, None)
+                    self._remove(lease_path)
+                    return False
+                if self.first_claim is None:
+                    self.first_claim = time.time()
+                return True
+            if not self._reclaim_expired(lease_path):
+                return False
+        return False
+
+    def holds(self, pdf_path) -> bool:
+        # Checked before output is written. A lease can be lost after its claim, e.g. taken over
+        # once expired, or replaced while another node reclaimed it; the new holder writes then.
+        lease_path = self.lease_dir / f"{self.job_key(pdf_path)}.lease"
+        try:
+            return lease_path.read_text(encoding='utf-8') == self._held.get(lease_path.name)
+        except OSError:
+            return False
+
+    def complete(self, pdf_path, seconds: float, status: str = "done"):
+        key = self.job_key(pdf_path)
+        self._held.pop(f"{key}.lease", None)
+        self._write_json(self.done_dir / f"{key}.json", {
+            "document": getattr(pdf_path, "name", None) or Path(pdf_path).name, "node": self.node_id, "pid": os.getpid(),
+            "status": status, "seconds": round(seconds, 3), "finished_at": time.time(),
+        })
+        self._remove(self.lease_dir / f"{key}.lease")
+
+        self.completed += 1
+        self.busy_seconds += seconds
+        self.last_complete = time.time()
+        self._write_json(self.node_dir / f"{self.node_id}.{os.getpid()}.json", {
+            "node": self.node_id, "pid": os.getpid(), "completed": self.completed,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "first_claim": self.first_claim, "last_complete": self.last_complete,
+        })
+
+    def release(self, pdf_path, pids) -> bool:
+        # Drops this node's lease if one of pids holds it, e.g. a worker killed mid-document
+        lease_path = self.lease_dir / f"{self.job_key(pdf_path)}.lease"
+        try:
+            lease = json.loads(lease_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return False
+        if lease.get("node") != self.node_id or lease.get("pid") not in pids:
+            return False
+        self._remove(lease_path)
+        return True
+
+    def node_stats(self) -> Dict[str, Dict[str, Any]]:
+        # Per-node totals across all processes that have reported to this ledger
+        nodes: Dict[str, Dict[str, Any]] = {}
+        for path in self.node_dir.glob("*.json"):
+            try:
+                stats = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            node = nodes.setdefault(stats["node"], {"completed": 0, "busy_seconds": 0.0,
+                                                    "first_claim": None, "last_complete": None})
+            node["completed"] += stats.get("completed", 0)
+            node["busy_seconds"] += stats.get("busy_seconds", 0.0)
+            for key, pick in (("first_claim", min), ("last_complete", max)):
+                if stats.get(key) is not None:
+                    node[key] = stats[key] if node[key] is None else pick(node[key], stats[key])
+
+        for node in nodes.values():
+            wall = (node["last_complete"] or 0) - (node["first_claim"] or 0)
+            node["docs_per_minute"] = round(node["completed"] / wall * 60, 2) if wall > 0 else None
+        return nodes
+
+    def _create_lease(self, lease_path: Path) -> bool:
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        text = json.dumps({"node": self.node_id, "pid": os.getpid(), "expires_at": time.time() + self.lease_seconds})
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        self._held[lease_path.name] = text
+        return True
+
+    def _reclaim_expired(self, lease_path: Path) -> bool:
+        try:
+            inspected = self._lease_identity(lease_path)
+        except FileNotFoundError:
+            # Released in the meantime, try to claim again
+            return True
+        try:
+            lease = json.loads(inspected[1])
+            expires_at = lease["expires_at"]
+        except (ValueError, TypeError, KeyError):
+            # Being written right now, or unreadable; judge it by age instead
+            lease = {}
+            expires_at = inspected[0] / 1e9 + self.lease_seconds
+
+        if expires_at > time.time():
+            return False
+
+        stale_path = lease_path.with_name(f"{lease_path.name}.stale.{self.node_id}.{os.getpid()}")
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            # Another node reclaimed it first; the retry decides who gets it
+            return True
+
+        # Between the read and the rename another node may have reclaimed the same lease and
+        # created a fresh one. Then that is the file just moved, and it is put back untouched.
+        try:
+            moved = self._lease_identity(stale_path)
+        except OSError:
+            moved = None
+        if moved != inspected:
+            self._restore(stale_path, lease_path)
+            return False
+
+        self._remove(stale_path)
+        logger.warning(f"Reclaimed expired lease on {lease_path.stem} from node {lease.get('node', 'unknown')}")
+        return True
+
+    @staticmethod
+    def _lease_identity(lease_path: Path):
+        # Renames keep the modification time, and a fresh lease differs in content or mtime
+        mtime_ns = lease_path.stat().st_mtime_ns
+        try:
+            text = lease_path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            raise
+        except (OSError, ValueError):
+            text = None
+        return mtime_ns, text
+
+    def _restore(self, stale_path: Path, lease_path: Path):
+        try:
+            # A link never replaces a lease created in the meantime
+            os.link(stale_path, lease_path)
+        except FileExistsError:
+            logger.warning(f"Lease on {lease_path.stem} was replaced while being restored")
+        except OSError:
+            os.replace(stale_path, lease_path)
+            return
+        self._remove(stale_path)
+
+    @staticmethod
+    def _remove(path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _write_json(path: Path, data: Dict[str, Any]):
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
@@ -3,64 +3,444 @@ import sys
 import json
 import time
 import logging
+import argparse
+from collections import deque
+from multiprocessing import util as mp_util
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
 from pathlib import Path
 from pdf_processor import PDFProcessor
+from result_cache import ResultCache
+from metrics import BatchMetrics
+from job_ledger import JobLedger
+from cost_model import CostModel
+from pdf_sources import PdfSource, is_archive, iter_archive
+from profiling import DocumentProfiler, profile_call
+from daemon import OutlineDaemon
 from utils import setup_logging, validate_output
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Per-process extractor used by pool workers, built once in _init_worker
+_worker_extractor = None
 
-class OutlineExtractor:
+
+class _RecordCollector(logging.Handler):
     def __init__(self):
-        self.processor = PDFProcessor()
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Flatten the record so it can be pickled back to the parent
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+    def drain(self):
+        records, self.records = self.records, []
+        return records
+
+
+def _init_worker(input_dir, output_dir, time_limit, cache_dir=None, cache_max_bytes=None, metrics_dir=None,
+                 ledger_args=None, profile_documents=False, page_workers=None):
+    global _worker_extractor
+
+    collector = _RecordCollector()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(collector)
+
+    _worker_extractor = OutlineExtractor()
+    _worker_extractor.processor = PDFProcessor()
+    if page_workers is not None:
+        # Documents already run in parallel across workers, so no nested page pools
+        _worker_extractor.processor.page_workers = page_workers
+    # A worker only exits once its children have, so its page pool is stopped and joined first, while
+    # the queue feeder threads (exit priority 10) can still carry the stop signal to the page workers
+    mp_util.Finalize(_worker_extractor.processor, _worker_extractor.processor.close, kwargs={"wait": True},
+                     exitpriority=20)
+    _worker_extractor.input_dir = Path(input_dir)
+    _worker_extractor.output_dir = Path(output_dir)
+    _worker_extractor.time_limit = time_limit
+    _worker_extractor.log_collector = collector
+    if cache_dir:
+        _worker_extractor.cache = ResultCache(cache_dir, cache_max_bytes)
+    if metrics_dir:
+        _worker_extractor.metrics_dir = Path(metrics_dir)
+    if ledger_args:
+        _worker_extractor.ledger = JobLedger(*ledger_args)
+    _worker_extractor.profile_documents = profile_documents
+    # Imports and model loading happen here, not inside the first document's time budget
+    _worker_extractor.processor.warm_up()
+    # Start-up messages are per worker and have no counterpart in the sequential log
+    collector.drain()
+
+
+def _process_in_worker(source):
+    cache = _worker_extractor.cache
+    before = cache.stats() if cache else {}
+    metrics, profile = _worker_extractor._process_profiled(source)
+    cache_delta = {k: v - before[k] for k, v in cache.stats().items()} if cache else {}
+    return _worker_extractor.log_collector.drain(), cache_delta, metrics, profile
+
+
+class OutlineExtractor:
+    def __init__(self, workers=1, cache=None, metrics_dir=None, ledger=None, profiler=None):
+        self.workers = max(1, int(workers))
+        # Batches run in pool workers, which build their own processor; the daemon creates one on start
+        self.processor = None
         self.input_dir = Path("./input")
         self.output_dir = Path("./output")
         self.time_limit = 10
+        # A pool worker still busy this long past the time limit is considered stuck and abandoned
+        self.abandon_grace = 5
+        self.log_collector = None
+        self.cache = cache
+        # Per-document metrics sidecars and a Prometheus file for the batch, when set
+        self.metrics_dir = Path(metrics_dir) if metrics_dir else None
+        self.batch_metrics = BatchMetrics()
+        # Shared job ledger, so several replicas on one input volume process each PDF once
+        self.ledger = ledger
+        # Archive members read ahead of the pool; bounds how many documents are held in memory
+        self.max_in_flight = self.workers * 2
+        # Profiles every document and keeps the slowest ones; pool workers only profile and send the stats back
+        self.profiler = profiler
+        self.profile_documents = profiler is not None
 
     def process_all_pdfs(self):
         try:
             self.output_dir.mkdir(parents=True, exist_ok=True)
+            if self.metrics_dir:
+                self.metrics_dir.mkdir(parents=True, exist_ok=True)
             pdf_files = list(self.input_dir.glob("*.pdf"))
+            archives = sorted(path for path in self.input_dir.glob("*") if path.is_file() and is_archive(path))
 
-            if not pdf_files:
+            if not pdf_files and not archives:
                 logger.warning("No PDF files found")
                 return
 
-            logger.info(f"Processing {len(pdf_files)} PDF files")
+            if pdf_files:
+                logger.info(f"Processing {len(pdf_files)} PDF files")
+            if archives:
+                logger.info(f"Processing PDFs from {len(archives)} archives")
+
+            # Each document keeps its position in the sequential order, which its logs are replayed in
+            positions = {path: position for position, path in enumerate(pdf_files)}
+            if self.workers > 1 or self.ledger:
+                # Several processes share the batch, so start the longest documents first.
+                # Archive members are streamed afterwards in archive order; ranking them would mean reading them all
+                settled = {path for path in pdf_files if self.ledger.is_done(path)} if self.ledger else ()
+                pdf_files = CostModel().order_longest_first(pdf_files, settled)
+
+            sources = chain(((positions[path], path) for path in pdf_files),
+                            enumerate(chain(*(iter_archive(path) for path in archives)), len(positions)))
+            # Even a single worker runs in its own process, so a document stuck inside one page
+            # can be abandoned without stalling the batch. Without archives the batch size is
+            # known, so no more workers than files are started.
+            self._process_parallel(sources, self.workers if archives else min(self.workers, len(pdf_files)))
+
+            if self.cache:
+                stats = self.cache.stats()
+                logger.info(f"Result cache: {stats['hits']} hits, {stats['misses']} misses, "
+                            f"{stats['evictions']} evictions")
+
+            if self.metrics_dir:
+                self._write_text(self.metrics_dir / "metrics.prom", self.batch_metrics.to_prometheus())
 
-            for pdf_file in pdf_files:
-                self._process_single_pdf(pdf_file)
+            if self.profiler:
+                self.profiler.write()
+
+            if self.ledger:
+                for node, stats in sorted(self.ledger.node_stats().items()):
+                    rate = stats["docs_per_minute"]
+                    logger.info(f"Node {node}: {stats['completed']} documents, {stats['busy_seconds']:.1f}s busy"
+                                + (f", {rate} documents/min" if rate is not None else ""))
 
         except Exception as e:
             logger.error(f"Critical error: {e}")
             sys.exit(1)
 
+    def _process_parallel(self, sources, workers):
+        init_args = (str(self.input_dir), str(self.output_dir), self.time_limit,
+                     str(self.cache.cache_dir) if self.cache else None,
+                     self.cache.max_bytes if self.cache else None,
+                     str(self.metrics_dir) if self.metrics_dir else None,
+                     (str(self.ledger.ledger_dir), self.ledger.node_id, self.ledger.lease_seconds) if self.ledger else None,
+                     self.profile_documents, 1 if workers > 1 else None)
+
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args)
+        # Workers presumed stuck on abandoned documents since the pool was last started
+        stuck = 0
+        sources = iter(sources)
+        futures = deque()
+
+        def fill():
+            # Only a window of documents is submitted at a time, so archive members are read as the pool
+            # frees up rather than all at once; files on disk are sent as paths and cost nothing here
+            while len(futures) < max(self.max_in_flight, workers):
+                position, source = next(sources, (None, None))
+                if source is None:
+                    return
+                source = source if isinstance(source, PdfSource) else PdfSource.from_path(source)
+                futures.append((position, source, executor.submit(_process_in_worker, source)))
+
+        def restart():
+            # Every worker may be stuck, so nothing would run again: replace the pool and resubmit what
+            # has no result yet. Leases held by the killed workers are released, or the documents
+            # would be skipped as claimed.
+            nonlocal executor
+            killed = self._terminate_workers(executor)
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args)
+            pending = list(futures)
+            futures.clear()
+            for position, source, future in pending:
+                if not future.done() or future.cancelled() or future.exception() is not None:
+                    if self.ledger:
+                        self.ledger.release(source, killed)
+                    future = executor.submit(_process_in_worker, source)
+                futures.append((position, source, future))
+
+        # Results finished ahead of an earlier position wait here, so logs come out in the sequential order
+        ready = {}
+        next_position = 0
+        try:
+            fill()
+            # Results are collected in submission order, so a stuck document is noticed while it is the oldest
+            while futures:
+                position, source, future = futures.popleft()
+                try:
+                    result = future.result(timeout=self.time_limit + self.abandon_grace)
+                except FutureTimeout:
+                    stuck += 1
+                    self._abandon(source)
+                    result = None
+                    if stuck >= workers:
+                        restart()
+                        stuck = 0
+                fill()
+                ready[position] = (source, result)
+                while next_position in ready:
+                    self._replay(*ready.pop(next_position))
+                    next_position += 1
+        finally:
+            if stuck:
+                # A worker stuck inside a page never returns on its own; stop the pool without waiting for it
+                self._terminate_workers(executor)
+            executor.shutdown(wait=not stuck, cancel_futures=bool(stuck))
+
+    @staticmethod
+    def _terminate_workers(executor):
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        for process in processes:
+            process.terminate()
+        return {process.pid for process in processes}
+
+    def _replay(self, source, result):
+        if result is None:
+            logger.error(f"Abandoning {source.name}: no result {self.abandon_grace}s after the time limit")
+            return
+        records, cache_delta, metrics, profile = result
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        if self.cache:
+            self.cache.merge_stats(cache_delta)
+        if not metrics.get("skipped"):
+            self.batch_metrics.add(metrics)
+        self._add_profile(source, metrics, profile)
+
+    def _abandon(self, source):
+        # Its log line is emitted in _replay, in sequential order
+        metrics = {"document": source.name, "cache_hit": False, "error": "abandoned", "truncated": True}
+        self._write_json(self._output_path(self.output_dir, source, ".json"),
+                         {"title": "", "outline": [], "truncated": True})
+        if self.ledger:
+            # Otherwise the lease expires and another node gets stuck on the same file
+            self.ledger.complete(source, self.time_limit + self.abandon_grace, status="abandoned")
+        if self.metrics_dir:
+            self.batch_metrics.add(metrics)
+            self._write_json(self._output_path(self.metrics_dir, source, ".metrics.json"), metrics, indent=2)
+
+    def _process_profiled(self, source):
+        # Returns the metrics and, when profiling, (seconds, pstats dict) of the call
+        if not self.profile_documents:
+            return self._process_single_pdf(source), None
+        metrics, seconds, stats = profile_call(self._process_single_pdf, source)
+        return metrics, (seconds, stats)
+
+    def _add_profile(self, source, metrics, profile):
+        if self.profiler and profile and not metrics.get("skipped"):
+            self.profiler.add(source.name, source.output_key, *profile)
+
     def _process_single_pdf(self, pdf_path):
+        # pdf_path is a path on disk or a PdfSource, e.g. an archive member held in memory
+        source = pdf_path if isinstance(pdf_path, PdfSource) else PdfSource.from_path(pdf_path)
         start_time = time.time()
-        output_path = self.output_dir / f"{pdf_path.stem}.json"
+        metrics = {"document": source.name, "cache_hit": False}
+
+        try:
+            if self.ledger and not self.ledger.claim(source):
+                logger.info(f"Skipping {source.name}: done or claimed by another node")
+                return {"document": source.name, "skipped": True}
+        except OSError as e:
+            logger.error(f"Could not claim {source.name} in the job ledger: {e}")
+            return {"document": source.name, "skipped": True}
 
+        output_path = self._output_path(self.output_dir, source, ".json")
         try:
-            logger.info(f"Processing: {pdf_path.name}")
-            result = self.processor.extract_outline_fast(str(pdf_path), start_time, self.time_limit)
+            logger.info(f"Processing: {source.name}")
+            result = None
+            cache_key = None
+            if self.cache:
+                cache_key = self.cache.make_key(source.document, self.processor.cache_fingerprint(self.time_limit))
+                result = self.cache.get(cache_key)
+                if result is not None:
+                    logger.info(f"Cache hit: {source.name}")
+                    metrics["cache_hit"] = True
 
-            if not validate_output(result):
-                result = {"title": "", "outline": []}
+            if result is None:
+                result = self.processor.extract_outline_fast(source.document, start_time, self.time_limit)
+                metrics.update(self.processor.document_metrics())
 
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
+                if not validate_output(result):
+                    result = {"title": "", "outline": []}
+                elif cache_key and not result.get("truncated") and metrics.get("early_return") != "error":
+                    # Partial outlines depend on machine load and failures may be transient (I/O, memory),
+                    # so only complete, successful ones are reused
+                    self.cache.put(cache_key, result)
+
+            if self._lost_lease(source):
+                return {"document": source.name, "skipped": True}
+            self._write_json(output_path, result, indent=2)
 
             elapsed_time = time.time() - start_time
-            logger.info(f"Completed {pdf_path.name} in {elapsed_time:.2f}s")
+            logger.info(f"Completed {source.name} in {elapsed_time:.2f}s")
 
         except Exception as e:
-            logger.error(f"Error processing {pdf_path.name}: {e}")
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump({"title": "", "outline": []}, f)
+            logger.error(f"Error processing {source.name}: {e}")
+            metrics["error"] = str(e)
+            if self._lost_lease(source):
+                return {"document": source.name, "skipped": True}
+            self._write_json(output_path, {"title": "", "outline": []})
+
+        metrics["seconds"] = round(time.time() - start_time, 6)
+        if self.ledger:
+            try:
+                self.ledger.complete(source, metrics["seconds"], status="error" if "error" in metrics else "done")
+            except OSError as e:
+                logger.warning(f"Could not record {source.name} in the job ledger: {e}")
+        if self.metrics_dir:
+            self.batch_metrics.add(metrics)
+            try:
+                self._write_json(self._output_path(self.metrics_dir, source, ".metrics.json"), metrics, indent=2)
+            except OSError as e:
+                logger.warning(f"Could not write metrics for {source.name}: {e}")
+        return metrics
+
+    def _lost_lease(self, source):
+        # Whoever holds the lease now writes the output; this process neither writes nor completes it
+        try:
+            if not self.ledger or self.ledger.holds(source):
+                return False
+        except OSError as e:
+            logger.warning(f"Could not check the lease on {source.name}: {e}")
+            return False
+        logger.warning(f"Lost the lease on {source.name} to another node, leaving its output to that node")
+        return True
+
+    @staticmethod
+    def _output_path(directory, source, suffix):
+        # Archive members keep their path inside the archive, under a directory named after it
+        output_path = directory / f"{source.output_key}{suffix}"
+        if output_path.parent != directory:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+        return output_path
+
+    def _write_json(self, output_path, data, indent=None):
+        self._write_text(output_path, json.dumps(data, indent=indent, ensure_ascii=False))
+
+    def _write_text(self, output_path, text):
+        # Write next to the target and rename, so readers never see a half-written file
+        tmp_path = output_path.with_name(f".{output_path.stem}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract titles and outlines from PDFs and PDF archives (zip, tar) in ./input")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("PDF_WORKERS", "1")),
+                        help="number of worker processes (default: $PDF_WORKERS or 1)")
+    parser.add_argument("--cache-dir", default=os.environ.get("PDF_CACHE_DIR"),
+                        help="directory for the persistent result cache (default: $PDF_CACHE_DIR, disabled if unset)")
+    parser.add_argument("--metrics-dir", default=os.environ.get("PDF_METRICS_DIR"),
+                        help="write <name>.metrics.json per document and metrics.prom per batch here "
+                             "(default: $PDF_METRICS_DIR, disabled if unset)")
+    parser.add_argument("--ledger-dir", default=os.environ.get("PDF_LEDGER_DIR"),
+                        help="shared directory for the job ledger, so replicas on one input volume split the work "
+                             "(default: $PDF_LEDGER_DIR, disabled if unset)")
+    parser.add_argument("--node-id", default=os.environ.get("PDF_NODE_ID"),
+                        help="name of this node in the job ledger (default: $PDF_NODE_ID or the hostname)")
+    parser.add_argument("--lease-seconds", type=float, default=float(os.environ.get("PDF_LEASE_SECONDS", "120")),
+                        help="seconds before an unfinished claim may be taken over by another node (default: 120)")
+    parser.add_argument("--cache-max-mb", type=int, default=int(os.environ.get("PDF_CACHE_MAX_MB", "512")),
+                        help="size limit of the result cache before eviction (default: 512)")
+    parser.add_argument("--profile", type=int, metavar="N", default=int(os.environ.get("PDF_PROFILE", "0")),
+                        help="profile every document and keep the N slowest: per-document .prof files, a merged "
+                             "hotspots.txt and stacks.collapsed for flame graphs (default: $PDF_PROFILE or off)")
+    parser.add_argument("--profile-dir", default=os.environ.get("PDF_PROFILE_DIR", "./profile"),
+                        help="where --profile writes its files (default: $PDF_PROFILE_DIR or ./profile)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--watch", action="store_true",
+                      help="keep running and process PDFs as they appear in the input directory")
+    mode.add_argument("--stdin", action="store_true",
+                      help="keep running and process PDF paths read line by line from stdin")
+    mode.add_argument("--serve", action="store_true",
+                      help="run a local HTTP service answering POST /outline with PDF bytes or {\"path\": ...}")
+    parser.add_argument("--poll-interval", type=float, default=1.0,
+                        help="seconds between input directory scans in --watch mode (default: 1.0)")
+    parser.add_argument("--host", default="127.0.0.1", help="address for --serve (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port for --serve (default: 8080)")
+    parser.add_argument("--max-pending", type=int,
+                        help="requests running or queued before --serve answers 429 (default: 4 per worker)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cache = ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024) if args.cache_dir else None
+    ledger = JobLedger(args.ledger_dir, args.node_id, args.lease_seconds) if args.ledger_dir else None
+    if args.serve:
+        from http_service import OutlineService
+        OutlineService(host=args.host, port=args.port, workers=args.workers, max_pending=args.max_pending).run()
+        return
 
+    if args.watch or args.stdin:
+        # Daemon modes keep a single warm processor in this process
+        daemon = OutlineDaemon(OutlineExtractor(cache=cache, metrics_dir=args.metrics_dir, ledger=ledger),
+                               poll_interval=args.poll_interval)
+        daemon.install_signal_handlers()
+        if args.watch:
+            daemon.watch()
+        else:
+            daemon.read_stdin()
+        return
 
-def main():
-    extractor = OutlineExtractor()
+    profiler = DocumentProfiler(args.profile, args.profile_dir) if args.profile > 0 else None
+    extractor = OutlineExtractor(workers=args.workers, cache=cache, metrics_dir=args.metrics_dir, ledger=ledger,
+                                 profiler=profiler)
     extractor.process_all_pdfs()
 
 
@@ -0,0 +1,71 @@
+from collections import Counter
+from typing import Any, Dict, List
+
+PREFIX = "pdf_outline"
+COUNTERS = ("pages", "pages_scanned", "lines", "candidates", "headings")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Per-document metrics of one batch, rendered as a Prometheus text-format file
+class BatchMetrics:
+    def __init__(self):
+        self.documents: List[Dict[str, Any]] = []
+
+    def add(self, metrics: Dict[str, Any]):
+        self.documents.append(metrics)
+
+    def to_prometheus(self) -> str:
+        stage_seconds = Counter()
+        totals = Counter()
+        paths = Counter()
+        fallbacks = Counter()
+        early_returns = Counter()
+        cache_hits = 0
+        errors = 0
+        truncated = 0
+        seconds = 0.0
+
+        for doc in self.documents:
+            stage_seconds.update(doc.get("stages", {}))
+            totals.update({name: doc.get(name, 0) for name in COUNTERS})
+            seconds += doc.get("seconds", 0.0)
+            cache_hits += bool(doc.get("cache_hit"))
+            errors += bool(doc.get("error"))
+            truncated += bool(doc.get("truncated"))
+            if "path" in doc:
+                paths[doc["path"]] += 1
+            if "fallback" in doc:
+                fallbacks[doc["fallback"]] += 1
+            if "early_return" in doc:
+                early_returns[doc["early_return"]] += 1
+
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append(f"# HELP {PREFIX}_{name} {help_text}")
+            out.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                out.append(f"{PREFIX}_{name}{{{label_text}}} {value}" if label_text else f"{PREFIX}_{name} {value}")
+
+        metric("documents_total", "counter", "Documents processed.", [({}, len(self.documents))])
+        metric("document_seconds_total", "counter", "Wall time spent on documents, including cache lookups.",
+               [({}, round(seconds, 6))])
+        metric("stage_seconds_total", "counter", "Wall time per pipeline stage.",
+               [({"stage": stage}, round(value, 6)) for stage, value in sorted(stage_seconds.items())])
+        for name in COUNTERS:
+            metric(f"{name}_total", "counter", f"Sum of per-document {name.replace('_', ' ')}.", [({}, totals[name])])
+        metric("path_total", "counter", "Documents by extraction path.",
+               [({"path": path}, count) for path, count in sorted(paths.items())])
+        metric("fallback_total", "counter", "Documents where a fallback or time-limit cut fired.",
+               [({"reason": reason}, count) for reason, count in sorted(fallbacks.items())])
+        metric("early_return_total", "counter", "Documents returned early with an empty outline.",
+               [({"reason": reason}, count) for reason, count in sorted(early_returns.items())])
+        metric("cache_hits_total", "counter", "Documents answered from the result cache.", [({}, cache_hits)])
+        metric("truncated_total", "counter", "Documents returned with a partial outline after the deadline.",
+               [({}, truncated)])
+        metric("errors_total", "counter", "Documents that failed and got an empty output.", [({}, errors)])
+        return "\n".join(out) + "\n"
@@ -0,0 +1,95 @@
+import time
+import heapq
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+# Anytime page scheduler: visits pages coarse-to-fine (ends, middle, quarters, ...) and
+# pulls the neighbours of pages that show heading-like lines ahead of the next refinement
+# level. Per-page parse cost is measured as it goes and the scan stops as soon as the next
+# page would no longer fit before the deadline.
+class PageScheduler:
+    def __init__(self, page_count, deadline, safety_factor=2.0, reserve_per_line=30e-6):
+        self.page_count = page_count
+        self.deadline = deadline
+        self.safety_factor = safety_factor
+        # Time kept back per collected line for heading detection after the scan
+        self.reserve_per_line = reserve_per_line
+        self.page_cost = None
+        self.visited = []
+        self._size_counts = Counter()
+        self._queue = []
+        self._queued = set()
+        self._seq = 0
+
+        for level, page_num in self.coarse_to_fine(page_count):
+            self._push(level, page_num)
+
+    @staticmethod
+    def coarse_to_fine(page_count):
+        if page_count <= 0:
+            return
+        yield 0, 0
+        if page_count > 1:
+            yield 0, page_count - 1
+
+        # Breadth-first bisection of the gaps between visited pages
+        intervals = [(0, page_count - 1)]
+        level = 1
+        while intervals:
+            next_intervals = []
+            for lo, hi in intervals:
+                if hi - lo < 2:
+                    continue
+                mid = (lo + hi) // 2
+                yield level, mid
+                next_intervals.append((lo, mid))
+                next_intervals.append((mid, hi))
+            intervals = next_intervals
+            level += 1
+
+    def _push(self, priority, page_num):
+        if page_num in self._queued or not 0 <= page_num < self.page_count:
+            return
+        self._queued.add(page_num)
+        heapq.heappush(self._queue, (priority, self._seq, page_num))
+        self._seq += 1
+
+    def _out_of_time(self, lines):
+        if self.page_cost is None:
+            return time.time() >= self.deadline
+        reserve = len(lines) * self.reserve_per_line
+        return time.time() + self.page_cost * self.safety_factor + reserve > self.deadline
+
+    def run(self, doc, lines, should_stop=None):
+        while self._queue and not self._out_of_time(lines) and not (should_stop and should_stop()):
+            priority, _, page_num = heapq.heappop(self._queue)
+
+            # Pages parsed earlier (e.g. page 0 for the title) cost nothing and say nothing about speed
+            if not lines.has_page(page_num):
+                start = time.perf_counter()
+                lines.ensure_pages(doc, [page_num])
+                cost = time.perf_counter() - start
+                # Moving average, but never below the latest sample, so a slow stretch is noticed at once
+                self.page_cost = cost if self.page_cost is None else max(cost, 0.7 * self.page_cost + 0.3 * cost)
+            self.visited.append(page_num)
+
+            if self._has_heading_signal(lines, page_num):
+                # Fill the gap around this page before refining elsewhere
+                for neighbour in (page_num - 1, page_num + 1):
+                    self._push(priority + 0.5, neighbour)
+
+        logger.info(f"Scheduled scan covered {len(self.visited)}/{self.page_count} pages")
+        return self.visited
+
+    def _has_heading_signal(self, lines, page_num):
+        sizes, bold, lengths = lines.page_columns(page_num, "size", "bold", "length")
+        if not sizes:
+            return False
+
+        self._size_counts.update(sizes)
+        body_size = self._size_counts.most_common(1)[0][0]
+        return any(size >= body_size * 1.15 or (is_bold and length <= 80)
+                   for size, is_bold, length in zip(sizes, bold, lengths))
@@ -0,0 +1,335 @@
+import re
+import zlib
+import logging
+from array import array
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import fitz
+
+from utils import clean_text
+
+logger = logging.getLogger(__name__)
+
+BOLD_FLAG = 16
+# Lines this much above the page's body size are treated as possible headings
+BODY_SIZE_TOLERANCE = 0.25
+# Cheap check on a line's first span for numbering, section words or all caps
+HEADING_PREFIX = re.compile(
+    r'\s*(?:\d|[IVXLCDM]+\.?\s|[A-Za-z]\.\s|[A-Z][A-Z\s\-]{4,}$|'
+    r'(?i:chapter|section|appendix|part|abstract|introduction|conclusion|references|bibliography))'
+)
+# Candidates for page numbers; numbering such as "2.1" is never one
+STANDALONE_NUMBER = re.compile(r'(?<![\w.])\d+(?![\w.])')
+# How far a printed page number may be from the page's index (front matter, offset numbering)
+MAX_PAGE_OFFSET = 50
+
+
+# Running headers and footers: lines in the top or bottom margin whose text repeats in the same
+# vertical band on at least min_pages pages, and on at least min_density of the pages between its
+# first and last one, which running lines do and chapter openers in the same spot do not. Each line
+# has two keys: its literal text ("Chapter 3 Methods" through a chapter) and its text with the page
+# number folded ("Page 3 of 40" and "Page 4 of 40", "1 Report" on page 3 and "2 Report" on page 4).
+# Keys are stable hashes, so stores parsed in other processes can be merged into one index.
+class RunningLineIndex:
+    def __init__(self, min_pages: int = 3, min_density: float = 0.5, margin: float = 0.12,
+                 band_height: float = 0.02):
+        self.min_pages = min_pages
+        self.min_density = min_density
+        self.margin = margin
+        self.band_height = band_height
+        self._pages: Dict[int, Set[int]] = {}
+        self.flagged: Set[int] = set()
+
+    def keys(self, text: str, relative_y: float, page_num: int, fold_page_number: bool = True) -> Tuple[int, int]:
+        # (literal key, page-folded key); -1 for lines outside the margins, which are never
+        # treated as running lines, and for lines without a number that could be the page's
+        if self.margin <= relative_y <= 1 - self.margin:
+            return -1, -1
+        normalized = " ".join(text.lower().split())
+        if not normalized:
+            return -1, -1
+        band = int(relative_y / self.band_height)
+        literal_key = self._hash(band, normalized)
+        if not fold_page_number:
+            return literal_key, -1
+        # The standalone number closest to the page's index is replaced by its offset from it, so a
+        # number that moves in step with the pages gives the same key on every page; other numbers,
+        # such as "of 40" or a year, stay as they are
+        numbers = [m for m in STANDALONE_NUMBER.finditer(normalized)
+                   if abs(int(m.group()) - page_num) <= MAX_PAGE_OFFSET]
+        if not numbers:
+            return literal_key, -1
+        number = min(numbers, key=lambda m: abs(int(m.group()) - page_num))
+        folded = f"{normalized[:number.start()]}#{int(number.group()) - page_num}{normalized[number.end():]}"
+        return literal_key, self._hash(band, folded)
+
+    @staticmethod
+    def _hash(band: int, normalized: str) -> int:
+        return zlib.crc32(f"{band}\0{normalized}".encode('utf-8')) & 0x7fffffff
+
+    def see(self, key: int, page_num: int):
+        if key < 0 or key in self.flagged:
+            return
+        pages = self._pages.setdefault(key, set())
+        pages.add(page_num)
+        if len(pages) >= self.min_pages and len(pages) >= self.min_density * (max(pages) - min(pages) + 1):
+            self.flagged.add(key)
+            del self._pages[key]
+
+    def flagged_mask(self, keys: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        if not self.flagged:
+            return np.zeros(len(keys), dtype=bool)
+        return np.isin(keys, np.fromiter(self.flagged, dtype=keys.dtype, count=len(self.flagged)))
+
+    def flagged_either(self, keys: "np.ndarray", page_keys: "np.ndarray") -> "np.ndarray":
+        return self.flagged_mask(keys) | self.flagged_mask(page_keys)
+
+
+# Columnar store of a document's text lines. Each page is parsed at most once and the
+# title extractor, heading detector and level assignment all read the same columns.
+# Plain body lines keep their numeric columns but no text (texts[i] is None), and so do
+# running headers and footers once the index has seen them on enough pages.
+class LineStore:
+    COLUMNS = (("page", "i"), ("block", "i"), ("size", "d"), ("bold", "b"), ("x0", "d"), ("y0", "d"),
+               ("length", "i"), ("materialized", "b"), ("running_key", "i"), ("page_key", "i"))
+
+    def __init__(self, running_index: Optional[RunningLineIndex] = None):
+        self.texts: List[str] = []
+        self._columns = {name: array(code) for name, code in self.COLUMNS}
+        self._page_ranges: Dict[int, Tuple[int, int]] = {}
+        self._arrays = None
+        # Pages whose lines are all materialized; page 0 feeds the title extractor
+        self.full_pages = {0}
+        self.min_body_chars = 400
+        self.running_index = running_index if running_index is not None else RunningLineIndex()
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def parsed_pages(self) -> List[int]:
+        return sorted(self._page_ranges)
+
+    def has_page(self, page_num: int) -> bool:
+        return page_num in self._page_ranges
+
+    def page_range(self, page_num: int) -> range:
+        start, end = self._page_ranges.get(page_num, (0, 0))
+        return range(start, end)
+
+    def page_columns(self, page_num: int, *names: str):
+        # Raw column slices for one page, without rebuilding the NumPy arrays
+        start, end = self._page_ranges.get(page_num, (0, 0))
+        return tuple(self._columns[name][start:end] for name in names)
+
+    def ensure_pages(self, doc, page_nums: Iterable[int], should_stop: Optional[Callable[[], bool]] = None) -> bool:
+        # Checked before every page; returns False if the scan stopped early
+        for page_num in page_nums:
+            if page_num in self._page_ranges:
+                continue
+            if should_stop is not None and should_stop():
+                return False
+            try:
+                self.add_page(page_num, doc[page_num])
+            except Exception as e:
+                logger.warning(f"Error processing page {page_num}: {e}")
+        return True
+
+    def add_page(self, page_num: int, page):
+        blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
+
+        # Tier 1: numeric features only, plus a character-weighted histogram of font sizes
+        raw_lines = []
+        size_chars = Counter()
+        for block_num, block in enumerate(blocks):
+            if "lines" not in block:
+                continue
+
+            for line in block["lines"]:
+                spans = line.get("spans")
+                if not spans:
+                    continue
+
+                max_font_size = 0.0
+                is_bold = False
+                x0 = y0 = None
+                raw_length = 0
+
+                for span in spans:
+                    raw_length += len(span.get("text", ""))
+                    font_size = span.get("size", 0)
+                    if font_size > max_font_size:
+                        max_font_size = font_size
+                    if span.get("flags", 0) & BOLD_FLAG:
+                        is_bold = True
+                    if x0 is None:
+                        span_bbox = span.get("bbox")
+                        if span_bbox and span_bbox[2] > span_bbox[0]:
+                            x0, y0 = span_bbox[0], span_bbox[1]
+
+                if raw_length == 0:
+                    continue
+                size_chars[max_font_size] += raw_length
+                raw_lines.append((block_num, spans, max_font_size, is_bold, x0 or 0.0, y0 or 0.0, raw_length))
+
+        # Sparse pages (title pages, section openers) are cheap and too small for a reliable body size
+        full_page = page_num in self.full_pages or sum(size_chars.values()) < self.min_body_chars
+        body_size = size_chars.most_common(1)[0][0] if size_chars else 0.0
+        page_top, page_height = page.rect.y0, page.rect.height
+        running_index = self.running_index
+
+        # Tier 2: text is only assembled and cleaned for lines that could be headings
+        start = len(self.texts)
+        texts = self.texts
+        col = self._columns
+        for block_num, spans, max_font_size, is_bold, x0, y0, raw_length in raw_lines:
+            materialize = (full_page or is_bold or max_font_size > body_size + BODY_SIZE_TOLERANCE
+                           or HEADING_PREFIX.match(spans[0].get("text", "")) is not None)
+            running_key = page_key = -1
+            if materialize:
+                raw_text = " ".join(span["text"] for span in spans if span.get("text"))
+                if page_height > 0:
+                    # Lines set larger than the body are titles, and "Module 3 Overview" on top of page 3
+                    # must not match "Module 4 Overview" on page 4, so only their literal text is keyed
+                    running_key, page_key = running_index.keys(
+                        raw_text, (y0 - page_top) / page_height, page_num,
+                        fold_page_number=max_font_size <= body_size + BODY_SIZE_TOLERANCE)
+                    running_index.see(running_key, page_num)
+                    running_index.see(page_key, page_num)
+                    # Known running lines are not cleaned again; full pages keep all text for the title
+                    if not full_page and (running_key in running_index.flagged or page_key in running_index.flagged):
+                        materialize = False
+            if materialize:
+                line_text = clean_text(raw_text)
+                if not line_text:
+                    continue
+                length = len(line_text)
+            else:
+                # Body lines still count towards the document's font and indent statistics
+                line_text = None
+                length = raw_length
+
+            texts.append(line_text)
+            col["page"].append(page_num)
+            col["block"].append(block_num)
+            col["size"].append(max_font_size)
+            col["bold"].append(is_bold)
+            col["x0"].append(x0)
+            col["y0"].append(y0)
+            col["length"].append(length)
+            col["materialized"].append(materialize)
+            col["running_key"].append(running_key)
+            col["page_key"].append(page_key)
+
+        self._page_ranges[page_num] = (start, len(texts))
+        self._arrays = None
+
+    def extend(self, other: "LineStore"):
+        # Appends the pages of another store (e.g. from a parallel worker), skipping pages already present
+        for page_num in other.parsed_pages:
+            if page_num in self._page_ranges:
+                continue
+            start, end = other._page_ranges[page_num]
+            offset = len(self.texts)
+            self.texts.extend(other.texts[start:end])
+            for name, column in self._columns.items():
+                column.extend(other._columns[name][start:end])
+            for key in other._columns["running_key"][start:end]:
+                self.running_index.see(key, page_num)
+            for key in other._columns["page_key"][start:end]:
+                self.running_index.see(key, page_num)
+            self._page_ranges[page_num] = (offset, len(self.texts))
+        self._arrays = None
+
+    def row(self, index: int) -> Tuple:
+        # (text, page, block, size, bold, x0, y0, length, materialized, running_key, page_key) from the raw buffers
+        return (self.texts[index],) + tuple(column[index] for column in self._columns.values())
+
+    def append_row(self, row: Tuple):
+        # Rows of one page must be appended together, in reading order
+        text, page_num = row[0], row[1]
+        self.texts.append(text)
+        for column, value in zip(self._columns.values(), row[1:]):
+            column.append(value)
+        self.running_index.see(row[-2], page_num)
+        self.running_index.see(row[-1], page_num)
+        start, _ = self._page_ranges.get(page_num, (len(self.texts) - 1, None))
+        self._page_ranges[page_num] = (start, len(self.texts))
+        self._arrays = None
+
+    def _column(self, name: str) -> "np.ndarray":
+        if self._arrays is None:
+            import numpy as np
+
+            # Copy out of the buffers so later add_page() calls can still grow them
+            self._arrays = {n: np.frombuffer(c, dtype=c.typecode).copy() if len(c) else np.array([], dtype=c.typecode)
+                            for n, c in self._columns.items()}
+            self._arrays["bold"] = self._arrays["bold"].astype(bool)
+            self._arrays["materialized"] = self._arrays["materialized"].astype(bool)
+        return self._arrays[name]
+
+    @property
+    def page(self) -> "np.ndarray":
+        return self._column("page")
+
+    @property
+    def block(self) -> "np.ndarray":
+        return self._column("block")
+
+    @property
+    def size(self) -> "np.ndarray":
+        return self._column("size")
+
+    @property
+    def bold(self) -> "np.ndarray":
+        return self._column("bold")
+
+    @property
+    def length(self) -> "np.ndarray":
+        return self._column("length")
+
+    @property
+    def materialized(self) -> "np.ndarray":
+        return self._column("materialized")
+
+    @property
+    def running_key(self) -> "np.ndarray":
+        return self._column("running_key")
+
+    @property
+    def page_key(self) -> "np.ndarray":
+        return self._column("page_key")
+
+    @property
+    def repeated(self) -> "np.ndarray":
+        # Running headers and footers as far as the index has seen them; not cached, the index keeps growing
+        return self.running_index.flagged_either(self.running_key, self.page_key)
+
+    @property
+    def x0(self) -> "np.ndarray":
+        return self._column("x0")
+
+    @property
+    def y0(self) -> "np.ndarray":
+        return self._column("y0")
+
+    def heading_lines(self) -> "np.ndarray":
+        import numpy as np
+
+        # Lines eligible for heading detection: more than two characters with a known font size.
+        # Pages may have been parsed out of order (probes, scheduler), detection sees them in page order
+        indices = np.flatnonzero((self.length > 2) & (self.size > 0))
+        return indices[np.argsort(self.page[indices], kind='stable')]
+
+    def line(self, index: int) -> Dict:
+        return {
+            "text": self.texts[index],
+            "page": int(self.page[index]) + 1,
+            "font_size": float(self.size[index]),
+            "is_bold": bool(self.bold[index]),
+            "x0": float(self.x0[index]),
+            "y0": float(self.y0[index]),
+        }
@@ -1,49 +1,201 @@
+import os
 import fitz
 import logging
 import time
-from heading_detector import HeadingDetector
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, TimeoutError as FutureTimeout
 from title_extractor import TitleExtractor
-from utils import clean_text, normalize_font_sizes
+from page_store import LineStore, RunningLineIndex
+from page_scheduler import PageScheduler
+from cost_model import CostModel
+from utils import clean_text, normalize_font_sizes, semantic_model_available, semantic_model_quantized
 
 logger = logging.getLogger(__name__)
 
+SCAN_MODES = ("auto", "full", "parallel", "scheduled", "streaming")
+
+# Bump whenever a change alters extraction results, so cached outputs are not reused
+PIPELINE_VERSION = "9"
+
+
+def _init_page_worker():
+    # Page workers exit with the process that started them, e.g. a batch worker terminated as stuck
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(1)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def _scan_page_range(source, start, end, deadline=None):
+    # Runs in a page worker process with its own document handle
+    lines = LineStore()
+    doc = fitz.open(stream=source, filetype="pdf") if isinstance(source, bytes) else fitz.open(source)
+    try:
+        # Like the sequential scans, the first page is parsed even past the deadline
+        lines.ensure_pages(doc, range(start, min(start + 1, end)))
+        lines.ensure_pages(doc, range(start + 1, end), lambda: deadline is not None and time.time() >= deadline)
+    finally:
+        doc.close()
+    return lines
+
 
 class PDFProcessor:
     def __init__(self):
-        self.heading_detector = HeadingDetector()
+        self._heading_detector = None
         self.title_extractor = TitleExtractor()
         self.max_full_scan_pages = 30
+        self.use_embedded_toc = True
+        self.min_toc_entries = 3
+        # Worker processes for page-parallel scans of documents above max_full_scan_pages; 1 disables them
+        self.page_workers = int(os.environ.get("PDF_PAGE_WORKERS", os.cpu_count() or 1))
+        self._page_pool = None
+        # Seconds kept back from the scan budget for level assignment and writing the result
+        self.detection_reserve = 0.5
+        # Page ranges stop at their deadline after the page in progress; their partial result is waited for this long
+        self.range_result_margin = 0.25
+        # Documents from this many pages on are scanned page by page without keeping every line
+        self.streaming_min_pages = int(os.environ.get("PDF_STREAMING_MIN_PAGES", 500))
+        self.streaming_chunk_pages = 32
+        # Predicts the full-scan time from a few timed pages; a scan is only chosen if it fits this many times over
+        self.cost_model = CostModel()
+        self.cost_safety = 1.5
+        # Below this predicted time a worker pool costs more than it saves
+        self.parallel_min_seconds = 1.0
+        # "auto" picks a scan per document; any other SCAN_MODES entry forces it, e.g. for evaluation
+        self.scan_mode = os.environ.get("PDF_SCAN_MODE", "auto")
+        # Seconds spent per stage, and counters such as pages scanned or the path taken, for the last document
+        self.stage_timings = {}
+        self.counters = {}
+        # Set by the watchdog at the hard deadline; every scan loop checks it before the next page
+        self._cancelled = threading.Event()
+
+    @property
+    def heading_detector(self):
+        # Imported on first use so that cache hits and bookmark lookups never load NumPy
+        if self._heading_detector is None:
+            from heading_detector import HeadingDetector
+            self._heading_detector = HeadingDetector()
+        return self._heading_detector
+
+    def warm_up(self):
+        # Long-running processes pay imports and model loading before the first document
+        detector = self.heading_detector
+        if detector.semantic_enabled:
+            detector.model
+
+    def close(self, wait=False):
+        if self._page_pool is not None:
+            self._page_pool.shutdown(wait=wait, cancel_futures=True)
+            self._page_pool = None
+
+    def cache_fingerprint(self, time_limit):
+        semantic = "semantic" if semantic_model_available() else "heuristic"
+        if semantic == "semantic" and semantic_model_quantized():
+            semantic = "semantic-int8"
+        return (f"{PIPELINE_VERSION}:{self.scan_mode}:{self.max_full_scan_pages}:{self.streaming_min_pages}:"
+                f"{time_limit}:{semantic}")
+
+    @contextmanager
+    def _timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def document_metrics(self):
+        return {"stages": {stage: round(seconds, 6) for stage, seconds in self.stage_timings.items()},
+                **self.counters}
+
+    def _count_detection(self, lines_scanned=None):
+        counts = self.heading_detector.last_counts
+        self.counters["lines"] = counts.get("lines", 0)
+        self.counters["candidates"] = counts.get("candidates", 0)
+        if lines_scanned is not None:
+            self.counters["pages_scanned"] = len(lines_scanned.parsed_pages)
+
+    def _should_stop(self, deadline):
+        return self._cancelled.is_set() or time.time() >= deadline
+
+    def _on_deadline(self):
+        logger.warning("Time limit reached, abandoning remaining work on this document")
+        self._cancelled.set()
 
     def extract_outline_fast(self, pdf_path, start_time, time_limit):
+        self.stage_timings = {}
+        self.counters = {}
+        self._cancelled.clear()
+        watchdog = threading.Timer(max(0.0, start_time + time_limit - time.time()), self._on_deadline)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            result = self._extract_outline(pdf_path, start_time, time_limit)
+        finally:
+            watchdog.cancel()
+
+        # Whatever was gathered before the deadline is returned, flagged as partial
+        if self.counters.get("truncated"):
+            result["truncated"] = True
+        return result
+
+    def _extract_outline(self, pdf_path, start_time, time_limit):
         doc = None
         try:
-            doc = fitz.open(pdf_path)
+            with self._timed("open"):
+                doc = self._open_document(pdf_path)
             page_count = len(doc)
+            self.counters["pages"] = page_count
 
             # Check if document is empty
             if page_count == 0:
                 logger.warning("PDF has no pages")
+                self.counters["early_return"] = "empty_document"
                 return {"title": "", "outline": []}
 
             elapsed = time.time() - start_time
             if elapsed > time_limit * 0.8:
                 logger.warning("Time limit reached before processing")
+                self.counters["early_return"] = "time_limit_before_processing"
+                self.counters["truncated"] = True
                 return {"title": "", "outline": []}
 
-            title = self.title_extractor.extract_title_fast(doc)
+            # Each page is parsed once into the shared line store
+            lines = LineStore()
+            with self._timed("title"):
+                title = self.title_extractor.extract_title_fast(doc, lines)
 
             elapsed = time.time() - start_time
             if elapsed > time_limit * 0.9:
                 logger.warning("Time limit reached after title extraction")
+                self.counters["early_return"] = "time_limit_after_title"
+                self.counters["truncated"] = True
                 return {"title": title, "outline": []}
 
+            # Bookmarks are authoritative and nearly free to read, so skip scanning when they look sane
+            if self.use_embedded_toc:
+                with self._timed("toc"):
+                    outline = self._extract_outline_from_toc(doc, page_count)
+                if outline:
+                    self.counters["path"] = "toc"
+                    self.counters["headings"] = len(outline)
+                    return {"title": title, "outline": outline}
+
             remaining_time = time_limit - elapsed
-            outline = self._extract_headings_adaptive(doc, page_count, remaining_time)
+            outline = self._extract_headings_adaptive(doc, page_count, remaining_time, lines, pdf_path)
+            self.counters["headings"] = len(outline)
+            if self.counters.get("pages_scanned", page_count) < page_count:
+                self.counters["truncated"] = True
 
             return {"title": title, "outline": outline}
 
         except Exception as e:
             logger.error(f"Error in PDF processing: {e}")
+            self.counters["early_return"] = "error"
             return {"title": "", "outline": []}
         finally:
             # Ensure document is always closed
@@ -53,147 +205,265 @@ class PDFProcessor:
                 except:
                     pass
 
-    def _extract_headings_adaptive(self, doc, page_count, remaining_time):
-        if page_count <= self.max_full_scan_pages and remaining_time > 3:
-            return self._extract_headings_full_scan(doc)
-        else:
-            sample_ratio = min(0.6, remaining_time / 10)
-            return self._extract_headings_sampled(doc, page_count, sample_ratio)
-
-    def _extract_headings_full_scan(self, doc):
-        text_elements = []
+    def _open_document(self, source):
+        # Raw PDF bytes (e.g. an HTTP upload) are opened from memory
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return fitz.open(stream=bytes(source), filetype="pdf")
+        return fitz.open(source)
 
+    def _extract_outline_from_toc(self, doc, page_count):
         try:
-            for page_num in range(len(doc)):
-                try:
-                    page = doc[page_num]
-                    blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
-
-                    for block in blocks:
-                        if "lines" not in block:
-                            continue
-
-                        for line in block["lines"]:
-                            if not line.get("spans"):
-                                continue
-
-                            line_text = ""
-                            max_font_size = 0
-                            is_bold = False
-                            bbox = [0, 0, 0, 0]
-
-                            for span in line["spans"]:
-                                span_text = span.get("text", "")
-                                if span_text:  # Only add non-empty text
-                                    line_text += span_text + " "
-
-                                font_size = span.get("size", 0)
-                                if font_size > 0:  # Only consider valid font sizes
-                                    max_font_size = max(max_font_size, font_size)
-
-                                if span.get("flags", 0) & 16:  # Bold flag
-                                    is_bold = True
-
-                                # Get bbox from first span with valid bbox
-                                span_bbox = span.get("bbox", [0, 0, 0, 0])
-                                if span_bbox and span_bbox[2] > span_bbox[0]:  # Valid bbox
-                                    if bbox == [0, 0, 0, 0]:
-                                        bbox = span_bbox
-
-                            line_text = clean_text(line_text)
-
-                            # More robust text validation
-                            if line_text and len(line_text.strip()) > 2 and max_font_size > 0:
-                                text_elements.append({
-                                    "text": line_text.strip(),
-                                    "page": page_num + 1,
-                                    "font_size": max_font_size,
-                                    "is_bold": is_bold,
-                                    "bbox": bbox
-                                })
+            toc = doc.get_toc(simple=True)
+        except Exception as e:
+            logger.warning(f"Could not read embedded outline: {e}")
+            return []
 
-                except Exception as e:
-                    logger.warning(f"Error processing page {page_num}: {e}")
-                    continue
+        if not self._is_plausible_toc(toc, page_count):
+            return []
+
+        outline = []
+        for level, text, page in toc:
+            text = clean_text(text)
+            if level > 3 or not text or not 1 <= page <= page_count:
+                continue
+            outline.append({"level": f"H{level}", "text": text, "page": page})
+
+        logger.info(f"Using embedded outline with {len(outline)} entries")
+        return outline
+
+    def _is_plausible_toc(self, toc, page_count):
+        if len(toc) < self.min_toc_entries or toc[0][0] != 1:
+            return False
+
+        previous_level = 0
+        valid_pages = 0
+        top_level_pages = []
+        for level, text, page in toc:
+            # Levels may only deepen one step at a time
+            if level > previous_level + 1:
+                return False
+            previous_level = level
+
+            if not text or not text.strip():
+                return False
+            if 1 <= page <= page_count:
+                valid_pages += 1
+                if level == 1:
+                    top_level_pages.append(page)
+
+        # Broken bookmark trees often point nowhere (page -1) or all at the same page
+        if valid_pages < len(toc) * 0.9:
+            return False
+        if page_count > 1 and len(toc) > 3 and len(set(top_level_pages)) <= 1:
+            return False
+
+        # Chapters should appear in reading order
+        backwards = sum(1 for a, b in zip(top_level_pages, top_level_pages[1:]) if b < a)
+        return backwards <= len(top_level_pages) * 0.1
+
+    def _extract_headings_adaptive(self, doc, page_count, remaining_time, lines, source=None):
+        if self.scan_mode != "auto":
+            return self._extract_headings_forced(doc, page_count, remaining_time, lines, source)
 
+        if page_count <= self.max_full_scan_pages and remaining_time > 3:
+            return self._extract_headings_full_scan(doc, lines, remaining_time)
+        elif page_count >= self.streaming_min_pages:
+            return self._extract_headings_streaming(doc, source, page_count, remaining_time, lines)
+
+        # Decide from the predicted cost before committing to a scan, not after the budget is spent
+        deadline = time.time() + remaining_time
+        with self._timed("estimate"):
+            estimate = self.cost_model.probe_document(doc, lines)
+        self.counters["predicted_seconds"] = round(estimate.seconds, 3)
+        remaining_time = deadline - time.time()
+        budget = remaining_time - self.detection_reserve
+        can_parallel = self.page_workers > 1 and source is not None
+
+        if estimate.seconds * self.cost_safety <= budget:
+            if can_parallel and estimate.seconds >= self.parallel_min_seconds:
+                return self._extract_headings_parallel(doc, source, page_count, remaining_time, lines)
+            return self._extract_headings_full_scan(doc, lines, remaining_time)
+        elif can_parallel and estimate.seconds / self.page_workers * self.cost_safety <= budget:
+            return self._extract_headings_parallel(doc, source, page_count, remaining_time, lines)
+        else:
+            return self._extract_headings_scheduled(doc, page_count, remaining_time, lines)
+
+    def _extract_headings_forced(self, doc, page_count, remaining_time, lines, source):
+        if self.scan_mode == "full":
+            return self._extract_headings_full_scan(doc, lines, remaining_time)
+        elif self.scan_mode == "parallel" and source is not None:
+            return self._extract_headings_parallel(doc, source, page_count, remaining_time, lines)
+        elif self.scan_mode == "streaming":
+            return self._extract_headings_streaming(doc, source, page_count, remaining_time, lines)
+        elif self.scan_mode == "scheduled":
+            return self._extract_headings_scheduled(doc, page_count, remaining_time, lines)
+
+        logger.warning(f"Scan mode {self.scan_mode!r} not available here, using the scheduled scan")
+        return self._extract_headings_scheduled(doc, page_count, remaining_time, lines)
+
+    def _extract_headings_full_scan(self, doc, lines, remaining_time):
+        self.counters["path"] = "full_scan"
+        deadline = time.time() + remaining_time - self.detection_reserve
+        try:
+            with self._timed("scan"):
+                if not lines.ensure_pages(doc, range(len(doc)), lambda: self._should_stop(deadline)):
+                    logger.warning(f"Full scan hit the time limit after {len(lines.parsed_pages)}/{len(doc)} pages")
+                    self.counters["fallback"] = "full_scan_time_limit"
         except Exception as e:
             logger.error(f"Error in full scan: {e}")
 
-        headings = self.heading_detector.detect_headings(text_elements)
-        return self._assign_heading_levels_smart(headings)
+        return self._detect_and_assign(lines)
 
-    def _extract_headings_sampled(self, doc, page_count, sample_ratio):
-        sample_size = max(10, int(page_count * sample_ratio))
-        sample_pages = set()
+    def _detect_and_assign(self, lines):
+        with self._timed("detect"):
+            headings = self.heading_detector.detect_headings(lines)
+        self._count_detection(lines)
+        with self._timed("levels"):
+            return self._assign_heading_levels_smart(headings)
 
-        # Always include first pages
-        first_pages = min(5, page_count // 4)
-        sample_pages.update(range(first_pages))
+    def _extract_headings_parallel(self, doc, source, page_count, remaining_time, lines):
+        self.counters["path"] = "parallel"
+        if isinstance(source, (bytearray, memoryview)):
+            source = bytes(source)
 
-        # Always include last pages
-        last_pages = min(3, page_count // 6)
-        sample_pages.update(range(page_count - last_pages, page_count))
-
-        # Fill remaining samples from middle
-        remaining_samples = sample_size - len(sample_pages)
-        if remaining_samples > 0:
-            middle_start = first_pages
-            middle_end = page_count - last_pages
-            if middle_end > middle_start:
-                step = max(1, (middle_end - middle_start) // remaining_samples)
-                sample_pages.update(range(middle_start, middle_end, step))
-
-        text_elements = []
+        # A couple of contiguous ranges per worker keeps them busy if some pages are slower
+        chunk_count = min(page_count, self.page_workers * 2)
+        bounds = [page_count * i // chunk_count for i in range(chunk_count + 1)]
 
         try:
-            for page_num in sorted(list(sample_pages)[:sample_size]):
+            if self._page_pool is None:
+                self._page_pool = ProcessPoolExecutor(max_workers=self.page_workers, initializer=_init_page_worker)
+            deadline = time.time() + remaining_time - self.detection_reserve
+            futures = [self._page_pool.submit(_scan_page_range, source, start, end, deadline)
+                       for start, end in zip(bounds, bounds[1:]) if end > start]
+            with self._timed("scan"):
+                done, not_done = wait(futures, timeout=max(self.range_result_margin,
+                                                           deadline + self.range_result_margin - time.time()))
+        except Exception as e:
+            logger.warning(f"Parallel scan unavailable, falling back to scheduled scan: {e}")
+            self.counters["fallback"] = "parallel_unavailable"
+            self.close()
+            return self._extract_headings_scheduled(doc, page_count, remaining_time, lines)
+
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            logger.warning(f"Parallel scan hit the time limit, {len(not_done)} of {len(futures)} page ranges skipped")
+            self.counters["fallback"] = "parallel_time_limit"
+
+        # Merge in page order regardless of completion order
+        for future in futures:
+            if future in done:
                 try:
-                    page = doc[page_num]
-                    blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
-
-                    for block in blocks:
-                        if "lines" not in block:
-                            continue
-
-                        for line in block["lines"]:
-                            if not line.get("spans"):
-                                continue
-
-                            line_text = " ".join(span.get("text", "") for span in line["spans"] if span.get("text", ""))
-                            line_text = clean_text(line_text)
-
-                            if line_text and len(line_text.strip()) > 2:
-                                # More robust font size calculation
-                                font_sizes = [span.get("size", 0) for span in line["spans"] if span.get("size", 0) > 0]
-                                max_font_size = max(font_sizes) if font_sizes else 12  # Default font size
-
-                                is_bold = any(span.get("flags", 0) & 16 for span in line["spans"])
-
-                                # Get bbox from first valid span
-                                bbox = [0, 0, 0, 0]
-                                for span in line["spans"]:
-                                    span_bbox = span.get("bbox", [0, 0, 0, 0])
-                                    if span_bbox and span_bbox[2] > span_bbox[0]:
-                                        bbox = span_bbox
-                                        break
-
-                                text_elements.append({
-                                    "text": line_text.strip(),
-                                    "page": page_num + 1,
-                                    "font_size": max_font_size,
-                                    "is_bold": is_bold,
-                                    "bbox": bbox
-                                })
-
+                    lines.extend(future.result())
+                except Exception as e:
+                    logger.warning(f"Error in parallel page range: {e}")
+        # Ranges that stop at their own deadline still finish, just with fewer pages
+        if len(lines.parsed_pages) < page_count and "fallback" not in self.counters:
+            logger.warning(f"Parallel scan hit the time limit after {len(lines.parsed_pages)}/{page_count} pages")
+            self.counters["fallback"] = "parallel_time_limit"
+
+        return self._detect_and_assign(lines)
+
+    def _extract_headings_streaming(self, doc, source, page_count, remaining_time, lines):
+        self.counters["path"] = "streaming"
+        self.counters["pages_scanned"] = 0
+        deadline = time.time() + remaining_time - self.detection_reserve
+        if self.page_workers > 1 and source is not None:
+            page_stores = self._stream_pages_parallel(source, page_count, deadline)
+        else:
+            page_stores = self._stream_pages(doc, page_count, deadline, lines)
+
+        # Parsing and detection interleave here, so they are timed as one stage
+        with self._timed("stream"):
+            headings = self.heading_detector.detect_headings_streaming(page_stores)
+        self._count_detection()
+        with self._timed("levels"):
+            return self._assign_heading_levels_smart(headings)
+
+    def _stream_pages(self, doc, page_count, deadline, lines):
+        # Coarse-to-fine order, so a scan cut short by the deadline still spans the document
+        page_cost = None
+        visited = 0
+        # One index across the per-page stores, so running headers stop being materialized here as well
+        running_index = RunningLineIndex()
+        for _, page_num in PageScheduler.coarse_to_fine(page_count):
+            if self._cancelled.is_set() or (page_cost is not None and time.time() + page_cost * 2 > deadline):
+                logger.warning(f"Streaming scan hit the time limit after {visited}/{page_count} pages")
+                self.counters["fallback"] = "streaming_time_limit"
+                return
+            visited += 1
+            self.counters["pages_scanned"] = visited
+            # Pages already parsed for the title come from the shared store
+            if lines.has_page(page_num):
+                store = LineStore(running_index)
+                for i in lines.page_range(page_num):
+                    store.append_row(lines.row(i))
+                yield store
+                continue
+
+            start = time.perf_counter()
+            store = LineStore(running_index)
+            store.ensure_pages(doc, [page_num])
+            cost = time.perf_counter() - start
+            page_cost = cost if page_cost is None else max(cost, 0.7 * page_cost + 0.3 * cost)
+            yield store
+
+    def _stream_pages_parallel(self, source, page_count, deadline):
+        if isinstance(source, (bytearray, memoryview)):
+            source = bytes(source)
+
+        # Small ranges with a bounded number in flight, so finished results never pile up
+        chunk = self.streaming_chunk_pages
+        ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+        window = self.page_workers * 2
+        if self._page_pool is None:
+            self._page_pool = ProcessPoolExecutor(max_workers=self.page_workers, initializer=_init_page_worker)
+
+        pending = []
+        next_range = 0
+        scanned = 0
+        try:
+            while pending or next_range < len(ranges):
+                if self._cancelled.is_set():
+                    logger.warning(f"Streaming scan hit the time limit after {scanned}/{page_count} pages")
+                    self.counters["fallback"] = "streaming_time_limit"
+                    return
+                while next_range < len(ranges) and len(pending) < window:
+                    pending.append(self._page_pool.submit(_scan_page_range, source, *ranges[next_range], deadline))
+                    next_range += 1
+
+                future = pending.pop(0)
+                try:
+                    # The first range is always waited for, so a late start still yields its first page
+                    wait_for = deadline + self.range_result_margin - time.time()
+                    store = future.result(timeout=max(self.range_result_margin if scanned == 0 else 0.0, wait_for))
+                except FutureTimeout:
+                    logger.warning(f"Streaming scan hit the time limit after {scanned}/{page_count} pages")
+                    self.counters["fallback"] = "streaming_time_limit"
+                    return
                 except Exception as e:
-                    logger.warning(f"Error processing sampled page {page_num}: {e}")
+                    logger.warning(f"Error in parallel page range: {e}")
                     continue
+                scanned += len(store.parsed_pages)
+                self.counters["pages_scanned"] = scanned
+                yield store
+        finally:
+            for future in pending:
+                future.cancel()
 
+    def _extract_headings_scheduled(self, doc, page_count, remaining_time, lines):
+        self.counters["path"] = "scheduled"
+        try:
+            scheduler = PageScheduler(page_count, time.time() + remaining_time - self.detection_reserve)
+            with self._timed("scan"):
+                scheduler.run(doc, lines, self._cancelled.is_set)
+            if len(scheduler.visited) < page_count:
+                self.counters.setdefault("fallback", "scheduled_partial")
         except Exception as e:
-            logger.error(f"Error in sampled extraction: {e}")
+            logger.error(f"Error in scheduled extraction: {e}")
 
-        headings = self.heading_detector.detect_headings_ultra_fast(text_elements)
-        return self._assign_heading_levels_smart(headings)
+        return self._detect_and_assign(lines)
 
     def _assign_heading_levels_smart(self, headings):
         if not headings:
@@ -222,7 +492,7 @@ class PDFProcessor:
                 headings,
                 key=lambda x: (
                     x.get("page", 0),
-                    x.get("bbox", [0, 0, 0, 0])[1]  # y-coordinate
+                    x.get("y0", 0)  # y-coordinate
                 )
             )
 
@@ -0,0 +1,99 @@
+import tarfile
+import zipfile
+import logging
+from pathlib import Path, PurePosixPath
+from typing import Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# Members above this are skipped rather than read into memory
+MAX_MEMBER_BYTES = 512 * 1024 * 1024
+
+
+# One document to process: a file on disk, or the bytes of an archive member that are
+# opened as a fitz stream. output_key is the output path relative to the output directory,
+# without extension; for archive members it is the archive name plus the member path.
+class PdfSource:
+    __slots__ = ("name", "output_key", "path", "data")
+
+    def __init__(self, name: str, output_key: str, path: Optional[Path] = None, data: Optional[bytes] = None):
+        self.name = name
+        self.output_key = output_key
+        self.path = path
+        self.data = data
+
+    @classmethod
+    def from_path(cls, path) -> "PdfSource":
+        path = Path(path)
+        return cls(path.name, path.stem, path=path)
+
+    @property
+    def document(self) -> Union[str, bytes]:
+        # What PDFProcessor.extract_outline_fast and ResultCache.make_key accept
+        return self.data if self.data is not None else str(self.path)
+
+
+def is_archive(path: Path) -> bool:
+    name = path.name.lower()
+    return any(name.endswith(suffix) for suffix in ARCHIVE_SUFFIXES)
+
+
+def _archive_stem(path: Path) -> str:
+    name = path.name
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return path.stem
+
+
+def member_output_key(archive_path: Path, member_name: str) -> Optional[str]:
+    # Absolute paths and ".." components are dropped, so members can never write outside the output directory
+    parts = [part for part in PurePosixPath(member_name.replace("\\", "/")).parts
+             if part not in ("", ".", "..", "/")]
+    if not parts:
+        return None
+    parts[-1] = parts[-1][:-4] if parts[-1].lower().endswith(".pdf") else parts[-1]
+    return "/".join([_archive_stem(archive_path)] + parts)
+
+
+def iter_archive(archive_path: Path) -> Iterator[PdfSource]:
+    # Members are read one at a time, so only the documents in flight are held in memory
+    archive_path = Path(archive_path)
+    try:
+        if archive_path.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                        continue
+                    source = _member_source(archive_path, info.filename, info.file_size, lambda: archive.read(info))
+                    if source:
+                        yield source
+        else:
+            # "r|*" reads the tar as a stream: no seeking, no index of all members up front
+            with tarfile.open(archive_path, mode="r|*") as archive:
+                for member in archive:
+                    if not member.isfile() or not member.name.lower().endswith(".pdf"):
+                        continue
+                    source = _member_source(archive_path, member.name, member.size,
+                                            lambda: archive.extractfile(member).read())
+                    if source:
+                        yield source
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+        logger.error(f"Error reading archive {archive_path.name}: {e}")
+
+
+def _member_source(archive_path: Path, member_name: str, size: int, read) -> Optional[PdfSource]:
+    output_key = member_output_key(archive_path, member_name)
+    if output_key is None:
+        return None
+    if size > MAX_MEMBER_BYTES:
+        logger.warning(f"Skipping {archive_path.name}:{member_name}: {size} bytes is over the member size limit")
+        return None
+    try:
+        data = read()
+    except Exception as e:
+        # A corrupt, truncated or encrypted member only costs that member, not the rest of the batch
+        logger.error(f"Skipping {archive_path.name}:{member_name}: cannot read member: {e}")
+        return None
+    return PdfSource(f"{archive_path.name}:{member_name}", output_key, data=data)
@@ -0,0 +1,124 @@
+import io
+import heapq
+import marshal
+import cProfile
+import logging
+import pstats
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Below this a call path is left out of the collapsed stacks
+MIN_STACK_SECONDS = 1e-4
+MAX_STACK_DEPTH = 64
+
+
+def profile_call(fn: Callable, *args) -> Tuple[Any, float, Dict]:
+    # Returns the result, the wall time under the profiler and the raw pstats dict, which pickles
+    # across processes, unlike the profiler itself
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    result = profile.runcall(fn, *args)
+    seconds = time.perf_counter() - start
+    profile.create_stats()
+    return result, seconds, profile.stats
+
+
+def _frame_name(func) -> str:
+    filename, line, name = func
+    if filename == "~":
+        # Built-ins such as fitz's C calls or re.Pattern.sub
+        label = name.strip("<>")
+    else:
+        label = f"{Path(filename).name}:{name}"
+    return label.replace(";", ",").replace(" ", "_")
+
+
+def collapsed_stacks(stats: Dict) -> Counter:
+    # cProfile records caller/callee pairs, not full stacks. A function's time is split over its
+    # callers in proportion to the time each call edge took, which is exact for tree-shaped
+    # call graphs and a close estimate otherwise. Weights are microseconds.
+    callees: Dict[Any, List[Tuple[Any, float]]] = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    stacks: Counter = Counter()
+
+    def visit(func, path, seconds):
+        total = stats[func][3]
+        share = seconds / total if total > 0 else 0.0
+        self_seconds = stats[func][2] * share
+        if self_seconds >= MIN_STACK_SECONDS:
+            stacks[path] += int(round(self_seconds * 1e6))
+        if len(path.split(";")) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_seconds in callees.get(func, ()):
+            # Recursion is folded into the first occurrence
+            if callee == func or _frame_name(callee) in path.split(";"):
+                continue
+            callee_seconds = edge_seconds * share
+            if callee_seconds >= MIN_STACK_SECONDS:
+                visit(callee, f"{path};{_frame_name(callee)}", callee_seconds)
+
+    for func, (_, _, _, cumulative, callers) in stats.items():
+        if not callers:
+            visit(func, _frame_name(func), cumulative)
+    return stacks
+
+
+# Keeps the full profiles of the slowest documents of a batch and writes them out together:
+# one .prof file per document (for pstats or snakeviz), a hotspot table merged across them
+# and collapsed stacks for flame graph tools
+class DocumentProfiler:
+    def __init__(self, keep: int, output_dir, table_rows: int = 40):
+        self.keep = keep
+        self.output_dir = Path(output_dir)
+        self.table_rows = table_rows
+        self.profiled = 0
+        # Min-heap on seconds, so the fastest kept document is the one dropped
+        self._slowest: List[Tuple[float, int, str, str, Dict]] = []
+
+    def add(self, name: str, output_key: str, seconds: float, stats: Dict):
+        self.profiled += 1
+        entry = (seconds, self.profiled, name, output_key, stats)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, entry)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def write(self):
+        if not self._slowest:
+            return
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        slowest = sorted(self._slowest, reverse=True)
+
+        prof_paths = []
+        stacks: Counter = Counter()
+        for seconds, _, name, output_key, stats in slowest:
+            prof_path = self.output_dir / f"{output_key}.prof"
+            prof_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(prof_path, 'wb') as f:
+                marshal.dump(stats, f)
+            prof_paths.append(str(prof_path))
+            stacks.update(collapsed_stacks(stats))
+
+        table = io.StringIO()
+        table.write(f"Slowest {len(slowest)} of {self.profiled} profiled documents:\n")
+        for seconds, _, name, _, _ in slowest:
+            table.write(f"  {seconds:8.3f}s  {name}\n")
+        table.write("\n")
+        merged = pstats.Stats(*prof_paths, stream=table)
+        merged.strip_dirs().sort_stats("tottime").print_stats(self.table_rows)
+        merged.sort_stats("cumulative").print_stats(self.table_rows)
+        (self.output_dir / "hotspots.txt").write_text(table.getvalue(), encoding='utf-8')
+
+        with open(self.output_dir / "stacks.collapsed", 'w', encoding='utf-8') as f:
+            for stack, weight in sorted(stacks.items()):
+                if weight > 0:
+                    f.write(f"{stack} {weight}\n")
+
+        logger.info(f"Profiles of the {len(slowest)} slowest documents written to {self.output_dir}")
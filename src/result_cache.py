@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes = self._scan_size()
+
+    def make_key(self, pdf, fingerprint: str) -> str:
+        # pdf is a path or the PDF bytes themselves (archive members, uploads)
+        digest = hashlib.sha256()
+        if isinstance(pdf, (bytes, bytearray, memoryview)):
+            digest.update(pdf)
+        else:
+            with open(pdf, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        digest.update(b'\0' + fingerprint.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            # Touch the entry so eviction drops the least recently used results first
+            os.utime(path)
+            self.hits += 1
+            return result
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            # An overwritten entry no longer counts towards the total
+            try:
+                self._total_bytes -= path.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self._total_bytes += path.stat().st_size
+        except OSError as e:
+            logger.warning(f"Could not write result cache entry: {e}")
+            return
+
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def merge_stats(self, stats: Dict[str, int]):
+        self.hits += stats.get("hits", 0)
+        self.misses += stats.get("misses", 0)
+        self.evictions += stats.get("evictions", 0)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _entries(self):
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            yield path, stat
+
+    def _scan_size(self) -> int:
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def _evict(self):
+        # Other processes may share the directory, so re-scan instead of trusting the running total
+        entries = sorted(self._entries(), key=lambda item: item[1].st_mtime)
+        total = sum(stat.st_size for _, stat in entries)
+        target = int(self.max_bytes * 0.9)
+
+        for path, stat in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= stat.st_size
+                self.evictions += 1
+            except OSError:
+                continue
+
+        self._total_bytes = total
@@ -0,0 +1,69 @@
+import re
+from typing import FrozenSet, Iterable, NamedTuple, Optional, Pattern
+
+
+class TextMatch(NamedTuple):
+    keywords: FrozenSet[str]
+    pattern: Optional[int]
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    # Shared prefixes are factored out ("meth(?:od(?:ology|s)?)"), so a position that cannot
+    # start a keyword fails on its first character, and greedy optional tails prefer the longest keyword
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+# Keyword and pattern classification for heading text with two precompiled regexes:
+# a keyword trie finding every keyword substring and one anchored alternation
+# telling which pattern (by index) matches first.
+class TextMatcher:
+    def __init__(self, keywords: Iterable[str], patterns: Iterable[Pattern] = ()):
+        keywords = {k for k in keywords if k}
+        trie = _trie_regex(keywords) or '(?!)'
+        self._any_keyword = re.compile(trie)
+        # Zero-width, so every position reports the longest keyword starting there, overlaps included
+        self._keyword_starts = re.compile(f"(?=({trie}))")
+        # Shorter keywords hidden inside a reported one at the same position, e.g. "method" in "methods"
+        self._prefixes = {k: frozenset(p for p in keywords if k.startswith(p)) for k in keywords}
+
+        self.patterns = list(patterns)
+        branches = []
+        for i, pattern in enumerate(self.patterns):
+            flags = "i" if pattern.flags & re.IGNORECASE else "-i"
+            branches.append(f"(?P<p{i}>(?{flags}:{pattern.pattern}))")
+        # The regex engine tries branches in order, so the first matching pattern wins, as with a loop
+        self._patterns = re.compile("|".join(branches)) if branches else None
+
+    def has_keyword(self, text_lower: str) -> bool:
+        return self._any_keyword.search(text_lower) is not None
+
+    def keywords(self, text_lower: str) -> FrozenSet[str]:
+        found = set()
+        for keyword in self._keyword_starts.findall(text_lower):
+            found |= self._prefixes[keyword]
+        return frozenset(found)
+
+    def pattern_index(self, text: str) -> Optional[int]:
+        if self._patterns is None:
+            return None
+        match = self._patterns.match(text)
+        if match is None:
+            return None
+        return int(match.lastgroup[1:])
+
+    def match(self, text: str) -> TextMatch:
+        return TextMatch(self.keywords(text.lower()), self.pattern_index(text))
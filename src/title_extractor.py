@@ -1,18 +1,18 @@
 import re
 import logging
-import fitz
+from page_store import LineStore
 from utils import clean_text, is_likely_heading
 
 logger = logging.getLogger(__name__)
 
 
 class TitleExtractor:
-    def extract_title_fast(self, doc):
+    def extract_title_fast(self, doc, lines=None):
         title = self._extract_from_metadata(doc)
         if title:
             return title
 
-        title = self._extract_from_first_page_fast(doc)
+        title = self._extract_from_first_page_fast(doc, lines)
         if title:
             return title
 
@@ -32,56 +32,39 @@ class TitleExtractor:
             pass
         return ""
 
-    def _extract_from_first_page_fast(self, doc):
+    def _extract_from_first_page_fast(self, doc, lines=None):
         if len(doc) == 0:
             return ""
 
         try:
-            first_page = doc[0]
-            blocks = first_page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
+            if lines is None:
+                lines = LineStore()
+            lines.ensure_pages(doc, [0])
 
             candidates = []
-
-            # Look at more blocks to find title
-            for block in blocks[:5]:  # Increased from 3 to 5
-                if "lines" not in block:
+            blocks = lines.block
+            sizes = lines.size
+            bold = lines.bold
+            y_positions = lines.y0
+
+            for i in lines.page_range(0):
+                # Look at more blocks to find title
+                if blocks[i] >= 5:  # Increased from 3 to 5
                     continue
 
-                for line in block["lines"]:
-                    if not line.get("spans"):
-                        continue
-
-                    line_text = ""
-                    max_font_size = 0
-                    is_bold = False
-                    y_pos = 0
-
-                    for span in line["spans"]:
-                        line_text += span.get("text", "") + " "
-                        font_size = span.get("size", 0)
-                        if font_size > max_font_size:
-                            max_font_size = font_size
-                        if span.get("flags", 0) & 16:
-                            is_bold = True
-                        if not y_pos:
-                            y_pos = span.get("bbox", [0, 0, 0, 0])[1]
-
-                    line_text = clean_text(line_text)
-
-                    if self._is_title_candidate_fast(line_text, max_font_size, is_bold, y_pos):
-                        candidates.append({
-                            "text": line_text,
-                            "font_size": max_font_size,
-                            "is_bold": is_bold,
-                            "y_pos": y_pos
-                        })
+                line_text = lines.texts[i]
+                max_font_size = float(sizes[i])
+                y_pos = float(y_positions[i])
+
+                if self._is_title_candidate_fast(line_text, max_font_size, bold[i], y_pos):
+                    candidates.append((max_font_size, y_pos, line_text))
 
             if candidates:
                 # Sort by font size (desc) then by position (asc)
-                candidates.sort(key=lambda x: (-x["font_size"], x["y_pos"]))
-                best = candidates[0]
-                logger.info(f"Title from first page: {best['text']}")
-                return best["text"]
+                candidates.sort(key=lambda x: (-x[0], x[1]))
+                best = candidates[0][2]
+                logger.info(f"Title from first page: {best}")
+                return best
 
         except Exception as e:
             logger.warning(f"Error extracting title from first page: {e}")
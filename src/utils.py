@@ -1,6 +1,21 @@
 import re
+import os
 import logging
+import importlib.util
 from typing import Dict, Any
+from text_matcher import TextMatcher
+
+
+SENTENCE_MODEL_PATH = './models/sentence_model'
+# Written by download_models.py next to the model, so detectors do not re-encode the prototypes
+PROTOTYPE_EMBEDDINGS_PATH = './models/prototype_embeddings.npz'
+PROTOTYPE_TEXTS = [
+    "Introduction", "Abstract", "Summary", "Conclusion", "Discussion",
+    "Methodology", "Methods", "Results", "Analysis", "Evaluation",
+    "Background", "Literature Review", "Implementation", "Experiments",
+    "Chapter 1 Overview", "Section 2.1 Methods", "Appendix A Results",
+    "Theoretical Framework", "System Design", "Future Work"
+]
 
 
 def setup_logging():
@@ -10,16 +25,69 @@ def setup_logging():
     )
 
 
+def semantic_model_available() -> bool:
+    # Checks for the saved model and the library without importing either
+    return os.path.exists(SENTENCE_MODEL_PATH) and importlib.util.find_spec("sentence_transformers") is not None
+
+
+def semantic_model_threads() -> int:
+    # Intra-op threads per process; processes already run in parallel, so one each by default
+    return max(1, int(os.environ.get("HEADING_MODEL_THREADS", "1")))
+
+
+def semantic_model_quantized() -> bool:
+    # int8 dynamic quantization of the Linear layers; scores drift slightly from fp32
+    return os.environ.get("HEADING_MODEL_QUANTIZE", "0").lower() in ("1", "true", "yes")
+
+
+def embedding_cache_settings():
+    # Path of the shared on-disk embedding cache (disabled if unset) and its entry limit
+    return os.environ.get("HEADING_EMBEDDING_CACHE"), int(os.environ.get("HEADING_EMBEDDING_CACHE_ENTRIES", "100000"))
+
+
+WHITESPACE_RUN = re.compile(r'\s+')
+UNWANTED_CHARS = re.compile(r'[^\w\s\-\.\,\:\;\!\?\(\)\[\]\'\"]+')
+
+
 def clean_text(text: str) -> str:
     if not text:
         return ""
 
-    text = re.sub(r'\s+', ' ', text.strip())
-    text = re.sub(r'[^\w\s\-\.\,\:\;\!\?\(\)\[\]\'\"]+', '', text)
+    text = WHITESPACE_RUN.sub(' ', text.strip())
+    text = UNWANTED_CHARS.sub('', text)
 
     return text
 
 
+HEADING_KEYWORDS = {
+    'abstract', 'introduction', 'background', 'literature', 'review', 'summary',
+    'conclusion', 'conclusions', 'discussion', 'results', 'findings', 'analysis',
+    'evaluation', 'assessment', 'method', 'methods', 'methodology', 'approach',
+    'techniques', 'implementation', 'experiments', 'experimental', 'study',
+    'research', 'investigation', 'chapter', 'section', 'subsection', 'appendix',
+    'part', 'overview', 'references', 'bibliography', 'acknowledgments',
+    'acknowledgements', 'preface', 'contents', 'objectives', 'goals', 'aims',
+    'hypothesis', 'theory', 'theoretical', 'framework', 'model', 'design',
+    'architecture', 'system', 'algorithm', 'procedure', 'process', 'workflow',
+    'applications', 'case', 'examples', 'limitations', 'future', 'recommendations',
+    'implications', 'significance', 'contribution', 'novelty', 'related',
+    'previous', 'existing', 'current', 'proposed', 'solution', 'problem'
+}
+
+# Matched against lowercased text
+HEADING_PATTERNS = [
+    re.compile(r'^(chapter|section|appendix|part)\s+\d+'),
+    re.compile(r'^\d+(\.\d+)*\s+[a-zA-Z]'),
+    re.compile(r'^([ivxlcdm]+)\.?\s+[a-zA-Z]'),
+    re.compile(r'^[a-z]\.\s+[a-zA-Z]'),
+    re.compile(r'^(abstract|introduction|conclusion|references|bibliography)$')
+]
+
+HEADING_MATCHER = TextMatcher(HEADING_KEYWORDS, HEADING_PATTERNS)
+TITLE_CASE_PATTERN = re.compile(r'^[A-Z][a-z]*(\s+[A-Z][a-z]*)*$')
+SENTENCE_CASE_PATTERN = re.compile(r'^[A-Z][a-z]*.*[^.]$')
+
+
 def is_likely_heading(text: str) -> bool:
     if not text or len(text) < 3:
         return False
@@ -30,44 +98,19 @@ def is_likely_heading(text: str) -> bool:
     if len(text) > 150:
         return False
 
-    comprehensive_heading_keywords = {
-        'abstract', 'introduction', 'background', 'literature', 'review', 'summary',
-        'conclusion', 'conclusions', 'discussion', 'results', 'findings', 'analysis',
-        'evaluation', 'assessment', 'method', 'methods', 'methodology', 'approach',
-        'techniques', 'implementation', 'experiments', 'experimental', 'study',
-        'research', 'investigation', 'chapter', 'section', 'subsection', 'appendix',
-        'part', 'overview', 'references', 'bibliography', 'acknowledgments',
-        'acknowledgements', 'preface', 'contents', 'objectives', 'goals', 'aims',
-        'hypothesis', 'theory', 'theoretical', 'framework', 'model', 'design',
-        'architecture', 'system', 'algorithm', 'procedure', 'process', 'workflow',
-        'applications', 'case', 'examples', 'limitations', 'future', 'recommendations',
-        'implications', 'significance', 'contribution', 'novelty', 'related',
-        'previous', 'existing', 'current', 'proposed', 'solution', 'problem'
-    }
-
-    if any(keyword in text_lower for keyword in comprehensive_heading_keywords):
+    if HEADING_MATCHER.has_keyword(text_lower):
         return True
 
-    heading_patterns = [
-        r'^(chapter|section|appendix|part)\s+\d+',
-        r'^\d+(\.\d+)*\s+[a-zA-Z]',
-        r'^([ivxlcdm]+)\.?\s+[a-zA-Z]',
-        r'^[a-z]\.\s+[a-zA-Z]',
-        r'^(abstract|introduction|conclusion|references|bibliography)$'
-    ]
-
-    if any(re.match(pattern, text_lower) for pattern in heading_patterns):
+    if HEADING_MATCHER.pattern_index(text_lower) is not None:
         return True
 
     if text.isupper() and 5 <= len(text) <= 80:
         return True
 
-    title_case_pattern = r'^[A-Z][a-z]*(\s+[A-Z][a-z]*)*$'
-    if re.match(title_case_pattern, text) and len(text) <= 100:
+    if TITLE_CASE_PATTERN.match(text) and len(text) <= 100:
         return True
 
-    sentence_case_pattern = r'^[A-Z][a-z]*.*[^.]$'
-    if re.match(sentence_case_pattern, text) and 10 <= len(text) <= 60:
+    if SENTENCE_CASE_PATTERN.match(text) and 10 <= len(text) <= 60:
         word_count = len(text.split())
         if 2 <= word_count <= 8:
             return True